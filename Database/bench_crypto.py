@@ -0,0 +1,62 @@
+# bench_crypto.py
+# Throughput of encrypt_many / decrypt_many across batch sizes and threads
+import os
+import sqlite3
+import time
+
+from db_crypto import KeySession, decrypt_many, encrypt_many, encrypt_column, new_salt
+
+pw = "mystrongpassphrase"
+session = KeySession(pw, new_salt())
+
+for size in (1_000, 10_000, 100_000):
+    values = [f"Paciente {i:07d} - Diagnóstico confidencial" for i in range(size)]
+    for threads in sorted({1, 2, 4, os.cpu_count() or 1}):
+        start = time.perf_counter()
+        blobs = encrypt_many(values, session, workers=threads)
+        enc = time.perf_counter() - start
+
+        start = time.perf_counter()
+        plain = decrypt_many(blobs, session, encoding="utf-8", workers=threads)
+        dec = time.perf_counter() - start
+
+        assert plain == values
+        print(f"{size:>7,} values | {threads} threads | "
+              f"encrypt {size / enc:>10,.0f}/s | decrypt {size / dec:>10,.0f}/s")
+
+# Whole SQLite column, written back with executemany
+conn = sqlite3.connect(":memory:")
+conn.execute("CREATE TABLE pacientes (id INTEGER PRIMARY KEY, nombre TEXT)")
+conn.executemany("INSERT INTO pacientes (nombre) VALUES (?)", ((f"Paciente {i}",) for i in range(100_000)))
+start = time.perf_counter()
+rows = encrypt_column(conn, "pacientes", "nombre", session)
+conn.commit()
+print(f"encrypt_column: {rows:,} rows in {time.perf_counter() - start:.2f} s")
+
+session.close()
+
+# Streaming file encryption (64 MiB file)
+import tempfile
+from db_crypto import EncryptedFile, decrypt_file, encrypt_file
+
+with tempfile.TemporaryDirectory() as tmp:
+    plain_path = os.path.join(tmp, "datos.db")
+    with open(plain_path, "wb") as f:
+        for _ in range(64):
+            f.write(os.urandom(1 << 20))
+
+    start = time.perf_counter()
+    size = encrypt_file(plain_path, plain_path + ".enc", pw)
+    print(f"encrypt_file: {size / 2**20 / (time.perf_counter() - start):,.0f} MiB/s")
+
+    start = time.perf_counter()
+    decrypt_file(plain_path + ".enc", plain_path + ".out", pw)
+    print(f"decrypt_file: {size / 2**20 / (time.perf_counter() - start):,.0f} MiB/s")
+
+    with open(plain_path, "rb") as f:
+        f.seek(40_000_000)
+        expected = f.read(5_000)
+    with EncryptedFile(plain_path + ".enc", pw) as ef:
+        start = time.perf_counter()
+        assert ef.read(40_000_000, 5_000) == expected
+        print(f"random read: {ef.chunks} chunks, 5 kB at 40 MB in {(time.perf_counter() - start) * 1e3:.1f} ms")
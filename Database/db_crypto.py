@@ -2,12 +2,26 @@
 # --------------------------------------------------------------
 # Encrypt / decrypt arbitrary byte strings (e.g. DB column values)
 # using a user‑supplied passphrase.
+#
+# Blob formats
+#   v1 (legacy): salt (16 B) || nonce (12 B) || ciphertext+auth_tag
+#   v2         : b"DBC\x02" || nonce (12 B) || ciphertext+auth_tag
+#                (the salt is shared by a whole table / column and
+#                 kept outside the blob, so the key is derived once)
 # --------------------------------------------------------------
 
+import hashlib
+import hmac
 import os
-from typing import Tuple
+import sys
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from cryptography.exceptions import InvalidTag
 
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
@@ -34,17 +48,209 @@ def _derive_key(passphrase: str, salt: bytes, iterations: int = 200_000) -> byte
     return kdf.derive(passphrase_bytes)   # ← returns **bytes**
 
 
+# ----------------------------------------------------------------------
+# Derived‑key cache: PBKDF2 runs once per (passphrase, salt, iterations)
+# ----------------------------------------------------------------------
+SALT_SIZE = 16
+NONCE_SIZE = 12
+TAG_SIZE = 16
+V2_HEADER = b"DBC\x02"
+DEFAULT_ITERATIONS = 200_000
+
+# Random per‑process pepper: cache entries are indexed by an HMAC of the
+# passphrase, so the cache itself never holds the passphrase.
+_CACHE_PEPPER = os.urandom(32)
+
+
+def _wipe(buffer: bytearray) -> None:
+    """Overwrite a key buffer with zeros (best effort: copies made by the
+    cryptography backend are out of our reach)."""
+    buffer[:] = bytes(len(buffer))
+
+
+class KeyCache:
+    """
+    Bounded, thread‑safe LRU of derived keys.
+
+    Keys are held in ``bytearray`` buffers and zeroed when they are
+    evicted or when the cache is cleared.
+    """
+
+    def __init__(self, maxsize: int = 32):
+        self.maxsize = maxsize
+        self._keys: "OrderedDict[bytes, bytearray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _slot(passphrase: str, salt: bytes, iterations: int) -> bytes:
+        material = passphrase.encode("utf-8") + b"\x00" + bytes(salt) + iterations.to_bytes(8, "big")
+        return hmac.new(_CACHE_PEPPER, material, hashlib.sha256).digest()
+
+    def get(self, passphrase: str, salt: bytes, iterations: int = DEFAULT_ITERATIONS) -> bytes:
+        """Return a copy of the cached key, deriving it (outside the lock) on
+        a miss. The copy is taken under the lock, so a concurrent eviction
+        or ``clear()`` can never hand the caller a zeroed buffer."""
+        slot = self._slot(passphrase, salt, iterations)
+        with self._lock:
+            key = self._keys.get(slot)
+            if key is not None:
+                self._keys.move_to_end(slot)
+                return bytes(key)
+
+        key = bytearray(_derive_key(passphrase, bytes(salt), iterations))
+        if self.maxsize <= 0:
+            copy = bytes(key)
+            _wipe(key)
+            return copy
+        with self._lock:
+            if slot in self._keys:          # another thread won the race
+                _wipe(key)
+                key = self._keys[slot]
+                self._keys.move_to_end(slot)
+                return bytes(key)
+            self._keys[slot] = key
+            copy = bytes(key)
+            while len(self._keys) > self.maxsize:
+                _, old = self._keys.popitem(last=False)
+                _wipe(old)
+        return copy
+
+    def discard(self, passphrase: str, salt: bytes, iterations: int = DEFAULT_ITERATIONS) -> None:
+        """Drop and wipe a single key."""
+        with self._lock:
+            key = self._keys.pop(self._slot(passphrase, salt, iterations), None)
+        if key is not None:
+            _wipe(key)
+
+    def clear(self) -> None:
+        """Drop and wipe every key."""
+        with self._lock:
+            keys, self._keys = list(self._keys.values()), OrderedDict()
+        for key in keys:
+            _wipe(key)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+_KEY_CACHE = KeyCache()
+
+
+def clear_key_cache() -> None:
+    """Wipe every derived key held by the module‑level cache."""
+    _KEY_CACHE.clear()
+
+
+def new_salt() -> bytes:
+    """Fresh random salt to share across a table or column (v2 blobs)."""
+    return os.urandom(SALT_SIZE)
+
+
+def derive_subkey(master: bytes, label: str) -> bytearray:
+    """
+    HKDF‑SHA256(master, info = label) → 32‑byte key.
+
+    Different labels give independent keys, so one passphrase (and one
+    PBKDF2 run) can feed encryption and blind indexes without reusing keys.
+    """
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                info=b"db_crypto/" + label.encode("utf-8"))
+    return bytearray(hkdf.derive(bytes(master)))
+
+
+# ----------------------------------------------------------------------
+# Key session: one derived key, many values
+# ----------------------------------------------------------------------
+class KeySession:
+    """
+    Holds the key for one (passphrase, salt) pair and reuses a single
+    ``AESGCM`` object for every value.
+
+        with KeySession(pw, salt) as ks:
+            blob = ks.encrypt(b"...")          # v2 blob (nonce per value)
+            ks.decrypt(blob)                   # v2 or legacy v1 blobs
+
+    ``close()`` wipes the session key from memory and from the cache.
+    """
+
+    def __init__(self, passphrase: str, salt: Optional[bytes] = None,
+                 iterations: int = DEFAULT_ITERATIONS, cache: Optional[KeyCache] = None):
+        if salt is not None and len(salt) != SALT_SIZE:
+            raise ValueError(f"salt must be {SALT_SIZE} bytes")
+        self.salt = bytes(salt) if salt is not None else new_salt()
+        self.iterations = iterations
+        self._passphrase = passphrase
+        self._cache = cache if cache is not None else _KEY_CACHE
+        self._aead: Optional[AESGCM] = AESGCM(self._cache.get(passphrase, self.salt, iterations))
+
+    def _cipher(self) -> AESGCM:
+        if self._aead is None:
+            raise ValueError("KeySession is closed")
+        return self._aead
+
+    def encrypt(self, plaintext: bytes) -> bytes:
+        """v2 blob: header || nonce (12 B) || ciphertext+auth_tag"""
+        if not isinstance(plaintext, (bytes, bytearray)):
+            raise TypeError("plaintext must be bytes")
+        nonce = os.urandom(NONCE_SIZE)
+        return V2_HEADER + nonce + self._cipher().encrypt(nonce, plaintext, associated_data=None)
+
+    def decrypt(self, ciphertext_blob: bytes) -> bytes:
+        """Decrypts v2 blobs with the session key and legacy v1 blobs with
+        the key of their embedded salt (also cached)."""
+        if not isinstance(ciphertext_blob, (bytes, bytearray)):
+            raise TypeError("ciphertext_blob must be bytes")
+        aead = self._cipher()
+        if ciphertext_blob[:len(V2_HEADER)] == V2_HEADER:
+            start = len(V2_HEADER)
+            try:
+                return aead.decrypt(ciphertext_blob[start:start + NONCE_SIZE],
+                                    ciphertext_blob[start + NONCE_SIZE:], associated_data=None)
+            except InvalidTag:
+                # A v1 salt may start with the header bytes (p = 2^-32)
+                if len(ciphertext_blob) < SALT_SIZE + NONCE_SIZE + TAG_SIZE:
+                    raise
+        return decrypt(ciphertext_blob, self._passphrase, iterations=self.iterations, cache=self._cache)
+
+    def subkey(self, label: str) -> bytearray:
+        """Independent key for another purpose (e.g. a blind index), derived
+        from the session key with HKDF and *label*."""
+        self._cipher()
+        return derive_subkey(self._cache.get(self._passphrase, self.salt, self.iterations), label)
+
+    def close(self) -> None:
+        """Forget the cipher and wipe the key buffer."""
+        if self._aead is not None:
+            self._aead = None
+            self._cache.discard(self._passphrase, self.salt, self.iterations)
+            self._passphrase = ""
+
+    def __enter__(self) -> "KeySession":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
 # ----------------------------------------------------------------------
 # Public API
 # ----------------------------------------------------------------------
-def encrypt(plaintext: bytes, passphrase: str) -> bytes:
+def encrypt(plaintext: bytes, passphrase: str, salt: Optional[bytes] = None) -> bytes:
     """
     Returns a single blob:
         salt (16 B) || nonce (12 B) || ciphertext+auth_tag
+
+    With a shared *salt* the blob is v2 instead (header || nonce || ct):
+    the key comes from the cache, so only the first call pays PBKDF2.
     """
     if not isinstance(plaintext, (bytes, bytearray)):
         raise TypeError("plaintext must be bytes")
 
+    if salt is not None:
+        nonce = os.urandom(NONCE_SIZE)
+        aesgcm = AESGCM(_KEY_CACHE.get(passphrase, salt))
+        return V2_HEADER + nonce + aesgcm.encrypt(nonce, plaintext, associated_data=None)
+
     # 1️⃣ random salt for key derivation
     salt = os.urandom(16)
 
@@ -62,14 +268,28 @@ def encrypt(plaintext: bytes, passphrase: str) -> bytes:
     return salt + nonce + ct
 
 
-def decrypt(ciphertext_blob: bytes, passphrase: str) -> bytes:
+def decrypt(ciphertext_blob: bytes, passphrase: str, salt: Optional[bytes] = None,
+            iterations: int = DEFAULT_ITERATIONS, cache: Optional[KeyCache] = None) -> bytes:
     """
     Inverse of ``encrypt``.
     Expects the format produced by ``encrypt``:
         salt (16 B) || nonce (12 B) || ciphertext+auth_tag
+    or, when the shared *salt* is given, a v2 blob.
     """
     if not isinstance(ciphertext_blob, (bytes, bytearray)):
         raise TypeError("ciphertext_blob must be bytes")
+    cache = cache if cache is not None else _KEY_CACHE
+
+    if salt is not None and ciphertext_blob[:len(V2_HEADER)] == V2_HEADER:
+        start = len(V2_HEADER)
+        try:
+            return AESGCM(cache.get(passphrase, salt, iterations)).decrypt(
+                ciphertext_blob[start:start + NONCE_SIZE], ciphertext_blob[start + NONCE_SIZE:],
+                associated_data=None)
+        except InvalidTag:
+            # A v1 salt may start with the header bytes (p = 2^-32)
+            if len(ciphertext_blob) < SALT_SIZE + NONCE_SIZE + TAG_SIZE:
+                raise
 
     if len(ciphertext_blob) < 28:   # 16 B salt + 12 B nonce minimum
         raise ValueError("Ciphertext blob is too short")
@@ -80,8 +300,321 @@ def decrypt(ciphertext_blob: bytes, passphrase: str) -> bytes:
     ct = ciphertext_blob[28:]
 
     # 2️⃣ re‑derive the key from the supplied passphrase and extracted salt
-    key = _derive_key(passphrase, salt)
+    #    (cached, so re‑reading the same blob does not pay PBKDF2 again)
+    key = cache.get(passphrase, salt, iterations)
 
     # 3️⃣ decrypt and verify authenticity
     aesgcm = AESGCM(key)
     return aesgcm.decrypt(nonce, ct, associated_data=None)
+
+
+# ----------------------------------------------------------------------
+# Bulk API: whole columns across a thread pool
+# ----------------------------------------------------------------------
+BATCH_CHUNK = 2048          # values handed to each worker task
+
+
+def _to_bytes(value) -> Optional[bytes]:
+    """None / NaN stay NULL; str is UTF‑8 encoded; anything else via str()."""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return str(value).encode("utf-8")
+
+
+def _like(values, out: list):
+    """Return *out* with the container type of *values* (Series, ndarray or list)."""
+    # pandas / NumPy stay optional: if they are not imported, *values* is neither
+    pd = sys.modules.get("pandas")
+    if pd is not None and isinstance(values, pd.Series):
+        return pd.Series(out, index=values.index, name=values.name, dtype=object)
+    np = sys.modules.get("numpy")
+    if np is not None and isinstance(values, np.ndarray):
+        arr = np.empty(len(out), dtype=object)
+        arr[:] = out
+        return arr
+    return out
+
+
+def _map_chunks(func, items: list, workers: Optional[int], chunk_size: int) -> list:
+    """Apply *func* to consecutive chunks of *items*, in parallel when it pays off."""
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    if workers <= 1:
+        results = [func(chunk) for chunk in chunks]
+    else:
+        # AESGCM releases the GIL while OpenSSL works on each value
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(func, chunks))
+    return [value for chunk in results for value in chunk]
+
+
+def encrypt_many(values, session: KeySession, workers: Optional[int] = None,
+                 chunk_size: int = BATCH_CHUNK):
+    """
+    Encrypt a whole column into v2 blobs with one derived key.
+
+    *values* – iterable, NumPy object array or pandas Series (str / bytes;
+               other values go through ``str``; None / NaN stay None)
+    Returns the same container type, ready for ``executemany``.
+    """
+    items = [_to_bytes(v) for v in values]
+
+    def work(chunk):
+        return [None if v is None else session.encrypt(v) for v in chunk]
+
+    return _like(values, _map_chunks(work, items, workers, chunk_size))
+
+
+def decrypt_many(blobs, session: KeySession, encoding: Optional[str] = None,
+                 workers: Optional[int] = None, chunk_size: int = BATCH_CHUNK):
+    """
+    Inverse of ``encrypt_many`` (legacy v1 blobs are accepted too).
+    With *encoding* the plaintexts are decoded to ``str``.
+    """
+    items = list(blobs)
+
+    def work(chunk):
+        out = []
+        for blob in chunk:
+            if blob is None:
+                out.append(None)
+                continue
+            plain = session.decrypt(bytes(blob))
+            out.append(plain.decode(encoding) if encoding else plain)
+        return out
+
+    return _like(blobs, _map_chunks(work, items, workers, chunk_size))
+
+
+# ----------------------------------------------------------------------
+# SQLite helpers: BLOB columns through executemany
+# ----------------------------------------------------------------------
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def write_blobs(conn, table: str, column: str, keys, blobs, key_column: str = "rowid") -> int:
+    """
+    ``UPDATE table SET column = blob WHERE key_column = key`` for every pair,
+    in a single ``executemany``. Returns the number of rows written.
+    """
+    sql = f"UPDATE {_quote(table)} SET {_quote(column)} = ? WHERE {_quote(key_column)} = ?"
+    pairs = list(zip(blobs, keys))
+    conn.executemany(sql, pairs)
+    return len(pairs)
+
+
+def encrypt_column(conn, table: str, column: str, session: KeySession, key_column: str = "rowid",
+                   batch_size: int = 50_000, workers: Optional[int] = None) -> int:
+    """
+    Encrypt a column of an SQLite table in place, *batch_size* rows at a
+    time (constant memory). The caller commits.
+    """
+    done, last = 0, None
+    while True:
+        # 1️⃣ next batch by key (keyset pagination, no OFFSET)
+        where = f"WHERE {_quote(key_column)} > ? " if last is not None else ""
+        rows = conn.execute(
+            f"SELECT {_quote(key_column)}, {_quote(column)} FROM {_quote(table)} "
+            f"{where}ORDER BY {_quote(key_column)} LIMIT ?",
+            ((last,) if last is not None else ()) + (batch_size,),
+        ).fetchall()
+        if not rows:
+            return done
+
+        # 2️⃣ encrypt the batch across the pool
+        keys = [r[0] for r in rows]
+        blobs = encrypt_many([r[1] for r in rows], session, workers=workers)
+
+        # 3️⃣ write the blobs back in one executemany
+        done += write_blobs(conn, table, column, keys, blobs, key_column)
+        last = keys[-1]
+
+
+# ----------------------------------------------------------------------
+# Streaming file encryption (databases, CSV exports, backups)
+#
+#   header : b"DBCF\x01" || chunk_size (4 B) || salt (16 B) || prefix (7 B)
+#   chunk i: AES‑GCM(plaintext[i]) with
+#              nonce = prefix || i (4 B) || last flag (1 B)
+#              AAD   = header
+#
+# Each chunk is authenticated with its index and with the "last" flag, so
+# reordering, dropping or truncating chunks is detected. All chunks but
+# the last have the same size, which gives random access by offset.
+# ----------------------------------------------------------------------
+FILE_MAGIC = b"DBCF\x01"
+FILE_CHUNK = 1 << 20        # 1 MiB of plaintext per chunk
+_PREFIX_SIZE = 7
+_FILE_HEADER = len(FILE_MAGIC) + 4 + SALT_SIZE + _PREFIX_SIZE
+
+
+def _chunk_nonce(prefix: bytes, index: int, last: bool) -> bytes:
+    if index >= 1 << 32:
+        raise ValueError("too many chunks for one file")
+    return prefix + index.to_bytes(4, "big") + (b"\x01" if last else b"\x00")
+
+
+def _replace_atomically(dst, write) -> None:
+    """Run ``write(file)`` on ``dst.part`` and only then rename over *dst*."""
+    tmp = os.fspath(dst) + ".part"
+    try:
+        with open(tmp, "wb") as out:
+            write(out)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def encrypt_file(src, dst, passphrase: str, chunk_size: int = FILE_CHUNK,
+                 iterations: int = DEFAULT_ITERATIONS) -> int:
+    """
+    Encrypt file *src* into *dst* in constant memory (two chunks).
+    Returns the number of plaintext bytes.
+    """
+    if not 0 < chunk_size < 1 << 31:
+        raise ValueError("chunk_size out of range")
+
+    # 1️⃣ per‑file salt and nonce prefix → unique key and nonces
+    salt = new_salt()
+    prefix = os.urandom(_PREFIX_SIZE)
+    header = FILE_MAGIC + chunk_size.to_bytes(4, "big") + salt + prefix
+    aesgcm = AESGCM(_KEY_CACHE.get(passphrase, salt, iterations))
+    total = 0
+
+    def write(out):
+        nonlocal total
+        out.write(header)
+        with open(src, "rb") as f:
+            # 2️⃣ read one chunk ahead, so the final chunk gets the last flag
+            chunk, index = f.read(chunk_size), 0
+            while True:
+                following = f.read(chunk_size) if len(chunk) == chunk_size else b""
+                last = not following
+                out.write(aesgcm.encrypt(_chunk_nonce(prefix, index, last), chunk, header))
+                total += len(chunk)
+                if last:
+                    return
+                chunk, index = following, index + 1
+
+    _replace_atomically(dst, write)
+    return total
+
+
+class EncryptedFile:
+    """
+    Random‑access reader for files written by ``encrypt_file``.
+
+        with EncryptedFile("datos.db.enc", pw) as ef:
+            ef.read_chunk(3)
+            ef.read(offset, length)
+    """
+
+    def __init__(self, path, passphrase: str, iterations: int = DEFAULT_ITERATIONS):
+        self._f = open(path, "rb")
+        try:
+            # 1️⃣ parse and check the header
+            header = self._f.read(_FILE_HEADER)
+            if len(header) < _FILE_HEADER or not header.startswith(FILE_MAGIC):
+                raise ValueError("not an encrypted file (bad header)")
+            pos = len(FILE_MAGIC)
+            self.chunk_size = int.from_bytes(header[pos:pos + 4], "big")
+            salt = header[pos + 4:pos + 4 + SALT_SIZE]
+            self._prefix = header[pos + 4 + SALT_SIZE:]
+            self._header = header
+
+            # 2️⃣ geometry from the file size: every chunk but the last is full
+            body = os.fstat(self._f.fileno()).st_size - _FILE_HEADER
+            stride = self.chunk_size + TAG_SIZE
+            self.chunks = -(-body // stride)
+            last_len = body - (self.chunks - 1) * stride
+            if self.chunks == 0 or last_len < TAG_SIZE:
+                raise ValueError("encrypted file is truncated")
+            self.size = (self.chunks - 1) * self.chunk_size + last_len - TAG_SIZE
+
+            # 3️⃣ one PBKDF2 per file (cached)
+            self._aead = AESGCM(_KEY_CACHE.get(passphrase, salt, iterations))
+        except BaseException:
+            self._f.close()
+            raise
+
+    def read_chunk(self, index: int) -> bytes:
+        """Decrypt and authenticate chunk *index* only."""
+        if not 0 <= index < self.chunks:
+            raise IndexError("chunk index out of range")
+        stride = self.chunk_size + TAG_SIZE
+        self._f.seek(_FILE_HEADER + index * stride)
+        ct = self._f.read(stride)
+        last = index == self.chunks - 1
+        return self._aead.decrypt(_chunk_nonce(self._prefix, index, last), ct, self._header)
+
+    def read(self, offset: int, length: int) -> bytes:
+        """Plaintext bytes [offset, offset + length), touching only the chunks needed."""
+        end = min(offset + length, self.size)
+        if offset >= end:
+            return b""
+        first, final = offset // self.chunk_size, (end - 1) // self.chunk_size
+        data = b"".join(self.read_chunk(i) for i in range(first, final + 1))
+        start = offset - first * self.chunk_size
+        return data[start:start + end - offset]
+
+    def __iter__(self):
+        for index in range(self.chunks):
+            yield self.read_chunk(index)
+
+    def close(self) -> None:
+        self._f.close()
+        self._aead = None
+
+    def __enter__(self) -> "EncryptedFile":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def decrypt_file(src, dst, passphrase: str, iterations: int = DEFAULT_ITERATIONS) -> int:
+    """
+    Inverse of ``encrypt_file``. *dst* only appears once every chunk has
+    been authenticated. Returns the number of plaintext bytes.
+    """
+    with EncryptedFile(src, passphrase, iterations) as ef:
+        def write(out):
+            for chunk in ef:
+                out.write(chunk)
+
+        _replace_atomically(dst, write)
+        return ef.size
+
+
+# ----------------------------------------------------------------------
+# Blind indexes: keyed HMAC of the plaintext, for equality search
+#
+# Equal plaintexts give equal digests under the same key, so an ordinary
+# SQLite index on the digest finds the matching rows without decrypting
+# anything. This reveals which rows share a value (and nothing else
+# without the key); truncating to BLIND_SIZE bytes keeps the index small.
+# Columns whose keys come from the same passphrase, salt and label can
+# be joined on their blind indexes.
+# ----------------------------------------------------------------------
+BLIND_SIZE = 16
+
+
+def blind_index(value, key: bytes, size: int = BLIND_SIZE) -> Optional[bytes]:
+    """HMAC‑SHA256 of the value (normalised like ``encrypt_many``), truncated."""
+    data = _to_bytes(value)
+    if data is None:
+        return None
+    return hmac.new(key, data, hashlib.sha256).digest()[:size]
+
+
+def blind_index_many(values, key: bytes, size: int = BLIND_SIZE):
+    """``blind_index`` for a whole column (same container type as *values*)."""
+    return _like(values, [blind_index(v, key, size) for v in values])
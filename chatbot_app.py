@@ -11,9 +11,22 @@
 import os
 import io
 import time
-from typing import Optional, List, Tuple
+import codecs
+import hashlib
+import json
+import math
+import re
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, Optional, List, Tuple
+from urllib.parse import quote
 
 import streamlit as st
+import numpy as np
 import pandas as pd
 import altair as alt
 import sqlite3
@@ -27,6 +40,49 @@ st.set_page_config(
     layout="wide"
 )
 
+PAGE_CACHE_SIZE = 32        # páginas guardadas en memoria (LRU)
+SQLITE_MAX_READERS = 16     # conexiones de solo lectura en el pool
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_CACHE_SIZE_KB = 64_000          # PRAGMA cache_size por conexión
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024   # PRAGMA mmap_size (0 = desactivado)
+WRITER_TIMEOUT_S = 2.0      # espera máxima por el escritor en escrituras opcionales
+QUERY_CACHE_MAX_MB = 256    # memoria máxima de resultados cacheados (LRU)
+COMPACT_MIN_ROWS = 1000     # resultados más pequeños se cachean tal cual
+CATEGORY_MAX_RATIO = 0.5    # texto con menos distintos/filas que esto → category
+SAMPLE_ROWS = 10000         # filas de muestra para vistas previas
+MAX_CATEGORIES = 20         # máximo de valores para filtro por selección
+MAX_GROUPS = 50             # cardinalidad máxima para agrupar columnas numéricas
+IMPORT_CHUNK_ROWS = 50_000  # filas por lote (y por transacción) al importar CSV
+META_PREFIX = "_explorador_"  # tablas internas (metadatos, tablas sombra...)
+ROW_ID_COL = f"{META_PREFIX}fila"  # alias oculto de rowid en las tablas importadas (VACUUM no lo renumera)
+EXPORT_CHUNK_ROWS = 50_000  # filas por lote al exportar
+STATS_HIST_BINS = 20        # barras de los histogramas del catálogo de estadísticas
+STATS_TOP_VALUES = 5        # valores más frecuentes guardados por columna
+SCATTER_MAX_POINTS = 5000   # puntos máximos enviados al navegador
+SCATTER_GRID = 60           # celdas por eje (mapa de densidad y estratos del muestreo)
+SCATTER_DENSITY_ROWS = 100_000  # en modo automático, más filas → mapa de densidad
+SCATTER_SEED = 42           # semilla fija: la muestra no cambia entre ejecuciones
+TIMESERIES_MAX_POINTS = 500 # puntos máximos de la línea de tiempo (LTTB)
+BOX_SKETCH_BINS = 512       # resolución del sketch de cuantiles (barras por categoría)
+BOX_MAX_CATEGORIES = 15     # categorías más frecuentes en el diagrama de caja
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "explorador_exports")
+EXPORT_MAX_FILES = 20       # exportaciones guardadas en disco
+COLUMN_CACHE = True         # copia columnar (Arrow, memory-map) para la vista de datos; requiere pyarrow
+COLUMN_CACHE_DIR = os.path.join(tempfile.gettempdir(), "explorador_columnas")
+COLUMN_CACHE_OPEN = 4       # tablas columnares abiertas a la vez
+QUERY_WORKERS = 4           # consultas en segundo plano a la vez
+QUERY_TIMEOUT_S = 30        # tiempo máximo por consulta en segundo plano (configurable en la barra lateral)
+QUERY_BATCH_ROWS = 1000     # filas por lote de resultados parciales
+QUERY_PROGRESS_OPS = 10_000 # instrucciones de SQLite entre comprobaciones de cancelación
+QUERY_POLL_S = 0.5          # refresco de la vista de una consulta en curso
+PROFILE_MAX_RECORDS = 500   # llamadas guardadas en el panel de perfil
+INDEX_BUDGET_MB = 64        # disco máximo para los índices creados por el asesor
+INDEX_MIN_USES = 2          # consultas distintas antes de proponer un índice
+INDEX_MIN_DISTINCT = 10     # valores distintos mínimos para indexar una columna de filtro
+INDEX_SEEN_MAX = 1000       # consultas recordadas por el asesor para no contarlas dos veces (LRU)
+ENCRYPTION_ENV = "EXPLORADOR_CLAVE"  # variable de entorno con la clave de las columnas cifradas
+DECRYPT_CACHE_ENTRIES = 20_000  # valores descifrados guardados por sesión (LRU)
+
 # ======================
 # Estilos mejorados
 # ======================
@@ -127,64 +183,2457 @@ p, span, div, li, label, h1, h2, h3, h4, h5, h6 {
 # Funciones de utilidad
 # ======================
 
-@st.cache_resource
-def get_sqlite_connection(db_path: str):
-    """Conexión a SQLite con caché"""
-    if not os.path.exists(db_path):
+class ConnectionManager:
+    """Pool de conexiones SQLite: lectores de solo lectura y un único escritor
+
+    Cada hilo toma del pool su propia conexión ``mode=ro`` mientras lee (WAL
+    permite lecturas en paralelo con la escritura); las importaciones y demás
+    escrituras pasan por una sola conexión de escritura protegida con un lock.
+    """
+
+    def __init__(self, db_path: str, max_readers: int = SQLITE_MAX_READERS,
+                 cache_size_kb: int = SQLITE_CACHE_SIZE_KB, mmap_size: int = SQLITE_MMAP_SIZE,
+                 busy_timeout_ms: int = SQLITE_BUSY_TIMEOUT_MS):
+        self.db_path = db_path
+        self.max_readers = max_readers
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.busy_timeout_ms = busy_timeout_ms
+        self._idle: List[sqlite3.Connection] = []
+        self._open = 0
+        self._cond = threading.Condition()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._writer_lock = threading.Lock()
+        self._metrics = {'checkouts': 0, 'waits': 0, 'wait_s': 0.0,
+                         'writes': 0, 'writer_wait_s': 0.0, 'writer_timeouts': 0}
+        self._file_sig: Optional[tuple] = None
+        self._external = 0
+        
+        # Crea la BD si no existe y activa WAL (persistente en el archivo)
         conn = sqlite3.connect(db_path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.OperationalError:
+            pass  # BD en un medio de solo lectura
         conn.close()
-    conn = sqlite3.connect(db_path, check_same_thread=False)
-    return conn
 
-@st.cache_data(ttl=300)
-def run_query(db_path: str, sql: str) -> pd.DataFrame:
-    """Ejecuta query y parsea tipos automáticamente"""
-    conn = get_sqlite_connection(db_path)
-    df = pd.read_sql_query(sql, conn)
-    
-    # Parseo inteligente de tipos
+    def _configure(self, conn: sqlite3.Connection):
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+
+    def _new_reader(self) -> sqlite3.Connection:
+        uri = f"file:{quote(os.path.abspath(self.db_path))}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                               timeout=self.busy_timeout_ms / 1000)
+        self._configure(conn)
+        return conn
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Conexión de solo lectura exclusiva para el hilo actual mientras dure el bloque"""
+        start = time.perf_counter()
+        waited = False
+        with self._cond:
+            while not self._idle and self._open >= self.max_readers:
+                waited = True
+                self._cond.wait()
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._open += 1
+            self._metrics['checkouts'] += 1
+            if waited:
+                self._metrics['waits'] += 1
+                self._metrics['wait_s'] += time.perf_counter() - start
+        if conn is None:
+            try:
+                conn = self._new_reader()
+            except Exception:
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+                raise
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._cond:
+                self._idle.append(conn)
+                self._cond.notify()
+
+    @contextmanager
+    def writer(self, timeout: Optional[float] = None) -> Iterator[sqlite3.Connection]:
+        """Única conexión de escritura (autocommit: el llamador abre sus transacciones)
+
+        Con ``timeout`` lanza TimeoutError si el escritor sigue ocupado.
+        """
+        start = time.perf_counter()
+        if not self._writer_lock.acquire(timeout=-1 if timeout is None else timeout):
+            self._metrics['writer_timeouts'] += 1
+            raise TimeoutError("El escritor de la BD está ocupado")
+        try:
+            self._metrics['writes'] += 1
+            self._metrics['writer_wait_s'] += time.perf_counter() - start
+            if self._writer is None:
+                self._writer = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False,
+                                               timeout=self.busy_timeout_ms / 1000)
+                self._configure(self._writer)
+                self._writer.execute("PRAGMA synchronous=NORMAL")
+            yield self._writer
+        finally:
+            if self._writer is not None and self._writer.in_transaction:
+                self._writer.execute("ROLLBACK")
+            # Los cambios propios no cuentan como externos (ver ``external_changes``)
+            with self._cond:
+                self._file_sig = self._file_signature()
+            self._writer_lock.release()
+
+    def _file_signature(self) -> tuple:
+        sig = []
+        for path in (self.db_path, self.db_path + "-wal"):
+            try:
+                info = os.stat(path)
+            except OSError:
+                info = None
+            # Un WAL vacío (lo crea al abrirse cualquier conexión) equivale a no tenerlo
+            sig.append((info.st_size, info.st_mtime_ns) if info and info.st_size else None)
+        return tuple(sig)
+
+    def external_changes(self) -> int:
+        """Contador de cambios hechos por otros procesos (tamaño y mtime de la BD y del WAL)
+
+        Tras cada escritura propia se anota la firma de los archivos; si al
+        consultar no coincide, otro proceso ha escrito y el contador sube.
+        """
+        sig = self._file_signature()
+        with self._cond:
+            if self._file_sig is None:
+                self._file_sig = sig
+            elif sig != self._file_sig and not self._writer_lock.locked():
+                self._file_sig = sig
+                self._external += 1
+            return self._external
+
+    def metrics(self) -> Dict[str, float]:
+        """Métricas del pool"""
+        with self._cond:
+            return dict(self._metrics, readers_open=self._open, readers_idle=len(self._idle),
+                        readers_busy=self._open - len(self._idle), writer_busy=self._writer_lock.locked())
+
+@st.cache_resource
+def get_connection_manager(db_path: str) -> ConnectionManager:
+    """Pool de conexiones compartido por todas las sesiones"""
+    return ConnectionManager(db_path)
+
+def frame_bytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+def compact_frame(df: pd.DataFrame) -> Tuple[pd.DataFrame, int]:
+    """Representación compacta sin pérdida: texto repetido → category, números → el tipo más pequeño
+
+    Los float solo pasan a float32 si todos los valores se conservan exactos.
+    Devuelve el frame compacto y los bytes que ocupaba antes.
+    """
+    before = frame_bytes(df)
+    if len(df) < COMPACT_MIN_ROWS:
+        return df, before
+    out = {}
     for col in df.columns:
-        if df[col].dtype == 'object':
+        s = df[col]
+        if s.dtype == object:
+            if s.nunique(dropna=True) <= CATEGORY_MAX_RATIO * len(s):
+                s = s.astype('category')
+        elif pd.api.types.is_integer_dtype(s) and not pd.api.types.is_bool_dtype(s):
+            s = pd.to_numeric(s, downcast='integer')
+        elif pd.api.types.is_float_dtype(s) and s.dtype != np.float32:
+            as32 = s.astype(np.float32)
+            if ((as32.astype(np.float64) == s) | s.isna()).all():
+                s = as32
+        out[col] = s
+    return pd.DataFrame(out, index=df.index), before
+
+class QueryCache:
+    """Caché LRU de resultados acotada por bytes
+
+    La clave incluye la versión de los datos, así que un resultado nunca se
+    sirve de una versión anterior; además las importaciones invalidan
+    explícitamente las entradas de su tabla.
+    """
+
+    def __init__(self, max_bytes: int = QUERY_CACHE_MAX_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, Tuple[pd.DataFrame, int, tuple, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key: tuple) -> Optional[pd.DataFrame]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+        # Copia superficial: el llamador puede renombrar/añadir columnas sin tocar la caché
+        return entry[0].copy(deep=False)
+
+    def put(self, key: tuple, df: pd.DataFrame, scope: tuple, raw_bytes: Optional[int] = None) -> int:
+        """Guarda el resultado y devuelve su tamaño en bytes
+
+        ``raw_bytes`` es el tamaño antes de compactarlo (para el informe de memoria).
+        """
+        nbytes = frame_bytes(df)
+        if nbytes > self.max_bytes:
+            return nbytes
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (df, nbytes, scope, raw_bytes or nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, size, _, _) = self._entries.popitem(last=False)
+                self._bytes -= size
+                self._stats['evictions'] += 1
+        return nbytes
+
+    def nbytes(self, key: tuple) -> int:
+        """Tamaño de una entrada (0 si no está)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry is not None else 0
+
+    def invalidate(self, db_path: str, table: Optional[str] = None):
+        """Elimina las entradas de una tabla (y las globales de la BD)"""
+        with self._lock:
+            for key, (_, size, scope, _) in list(self._entries.items()):
+                if scope[0] == db_path and (table is None or scope[1] in (table, None)):
+                    del self._entries[key]
+                    self._bytes -= size
+                    self._stats['invalidations'] += 1
+
+    def memory_report(self) -> pd.DataFrame:
+        """Bytes en caché por tabla frente a lo que ocuparían sin compactar"""
+        with self._lock:
+            rows = [(scope[1] or "(global)", nbytes, raw) for _, nbytes, scope, raw in self._entries.values()]
+        report = pd.DataFrame(rows, columns=['tabla', 'bytes', 'sin_compactar'])
+        report = report.groupby('tabla', as_index=False).agg(
+            resultados=('bytes', 'size'), bytes=('bytes', 'sum'), sin_compactar=('sin_compactar', 'sum'))
+        report['ahorro'] = 1 - report['bytes'] / report['sin_compactar']
+        return report.sort_values('sin_compactar', ascending=False)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return dict(self._stats, entries=len(self._entries), bytes=self._bytes,
+                        hit_rate=self._stats['hits'] / lookups if lookups else 0.0)
+
+@st.cache_resource
+def get_query_cache() -> QueryCache:
+    """Caché de consultas compartida por todas las sesiones"""
+    return QueryCache()
+
+def data_version(db_path: str, table: Optional[str] = None) -> tuple:
+    """Versión de los datos: contador de la tabla, o esquema + contadores para toda la BD
+
+    El contador de cada tabla se incrementa en la misma transacción que la
+    reimporta (ver ``import_csv_to_db``); los cambios de otros procesos (BD
+    abierta con "Conectar") se detectan por los archivos y afectan a todas las tablas.
+    """
+    manager = get_connection_manager(db_path)
+    external = manager.external_changes()
+    with manager.reader() as conn:
+        try:
+            if table is None:
+                counter = conn.execute(f"SELECT COALESCE(SUM(version), 0) FROM {META_PREFIX}versiones").fetchone()[0]
+            else:
+                counter = conn.execute(f"SELECT COALESCE(MAX(version), 0) FROM {META_PREFIX}versiones WHERE tabla = ?",
+                                       (table,)).fetchone()[0]
+        except sqlite3.OperationalError:
+            counter = 0
+        if table is None:
+            return conn.execute("PRAGMA schema_version").fetchone()[0], counter, external
+    return counter, external
+
+# ======================
+# Perfil de consultas
+# ======================
+
+class QueryProfiler:
+    """Registro acotado de llamadas: tiempos, filas, bytes, caché y plan de SQLite"""
+
+    def __init__(self, max_records: int = PROFILE_MAX_RECORDS):
+        self._records: deque = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def record(self, operacion: str, segundos: float, tabla: Optional[str] = None, sql: Optional[str] = None,
+               motor: str = 'sqlite', cache: str = '-', filas: int = 0, bytes: int = 0,
+               tipos_s: float = 0.0, plan: Optional[str] = None):
+        entry = {
+            'hora': datetime.now().isoformat(timespec='milliseconds'), 'operacion': operacion,
+            'motor': motor, 'tabla': tabla, 'cache': cache, 'segundos': round(segundos, 6),
+            'tipos_s': round(tipos_s, 6), 'filas': int(filas), 'bytes': int(bytes),
+            'escaneo': full_scan(plan), 'sql': sql, 'plan': plan,
+        }
+        with self._lock:
+            self._records.append(entry)
+
+    def records(self) -> List[Dict]:
+        with self._lock:
+            return list(self._records)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def to_jsonl(self) -> str:
+        return "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in self.records())
+
+@st.cache_resource
+def get_profiler() -> QueryProfiler:
+    """Perfil de consultas compartido por todas las sesiones"""
+    return QueryProfiler()
+
+def explain_plan(db_path: str, sql: str, params: Tuple = ()) -> Optional[str]:
+    """EXPLAIN QUERY PLAN de una consulta SELECT (una línea por paso)"""
+    if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    try:
+        with get_connection_manager(db_path).reader() as conn:
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    except sqlite3.Error:
+        return None
+    return "\n".join(row[3] for row in rows)
+
+def full_scan(plan: Optional[str]) -> bool:
+    """True si el plan recorre alguna tabla entera (SCAN sin índice)"""
+    if not plan:
+        return False
+    return any(line.startswith('SCAN ') and 'USING' not in line and 'VIRTUAL TABLE' not in line
+               and 'CONSTANT ROW' not in line for line in plan.splitlines())
+
+# ======================
+# Motores de consulta
+# ======================
+
+class QueryEngine:
+    """Motor SQLite (por defecto): lee con el pool de lectores
+
+    Los métodos de dialecto devuelven fragmentos SQL que cambian entre motores.
+    """
+    name = 'sqlite'
+    label = 'SQLite'
+
+    def read(self, db_path: str, sql: str, params: Tuple, table: Optional[str]) -> pd.DataFrame:
+        with get_connection_manager(db_path).reader() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def is_number(self, c: str) -> str:
+        return f"typeof({c}) IN ('integer', 'real')"
+
+    def bucket(self, expr: str, last: str) -> str:
+        """Índice de barra entero (truncado) y acotado a ``last``"""
+        return f"MIN(CAST({expr} AS INTEGER), {last})"
+
+    def available(self, db_path: str, table: str, filters: Tuple = ()) -> bool:
+        return True
+
+class DuckDBEngine(QueryEngine):
+    """Motor columnar embebido (DuckDB) sobre la copia Arrow de la tabla
+
+    Solo atiende consultas de una tabla cuya copia columnar ya está lista
+    (ver ``ColumnCache``); la copia ya está tipada, así que los valores no
+    numéricos de columnas numéricas son NULL.
+    """
+    name = 'duckdb'
+    label = 'DuckDB'
+
+    def read(self, db_path: str, sql: str, params: Tuple, table: Optional[str]) -> pd.DataFrame:
+        import pyarrow as pa
+        
+        arrow_table = get_column_cache().get(db_path, table, data_version(db_path, table),
+                                             type_catalog(db_path, table))
+        if arrow_table is None:
+            raise RuntimeError(f"La copia columnar de {table} no está lista")
+        # Un cursor por consulta: las tablas registradas son locales al cursor
+        cursor = get_duckdb().cursor()
+        try:
+            cursor.register(table, arrow_table)
+            result = cursor.execute(sql, list(params))
+            result = result.to_arrow_table() if hasattr(result, 'to_arrow_table') else result.fetch_arrow_table()
+        finally:
+            cursor.close()
+        # SUM de enteros devuelve HUGEINT (decimal sin escala): entero como en SQLite
+        for i, field in enumerate(result.schema):
+            if pa.types.is_decimal(field.type) and field.type.scale == 0:
+                result = result.set_column(i, field.name, result.column(i).cast(pa.int64()))
+        return result.to_pandas()
+
+    def is_number(self, c: str) -> str:
+        return f"{c} IS NOT NULL"
+
+    def bucket(self, expr: str, last: str) -> str:
+        # CAST a entero redondea en DuckDB: se trunca antes
+        return f"least(CAST(trunc({expr}) AS BIGINT), {last})"
+
+    def available(self, db_path: str, table: str, filters: Tuple = ()) -> bool:
+        try:
+            import duckdb  # noqa: F401
+        except ImportError:
+            return False
+        if any(f[0] in ('match', 'blind') for f in filters):
+            return False  # los índices FTS5 y ciegos solo existen en SQLite
+        if any(f[0] == 'contains' for f in filters):
+            # LIKE de SQLite ignora mayúsculas (solo ASCII) y el de DuckDB no; ni ILIKE
+            # coincide fuera de ASCII, así que para dar los mismos resultados se usa SQLite
+            return False
+        return get_column_cache().get(db_path, table, data_version(db_path, table),
+                                      type_catalog(db_path, table)) is not None
+
+@st.cache_resource
+def get_duckdb():
+    """Base de datos DuckDB en memoria compartida (crear una conexión cuesta ~20 ms)"""
+    import duckdb
+    return duckdb.connect()
+
+ENGINES = {engine.name: engine for engine in (QueryEngine(), DuckDBEngine())}
+
+def query_engine(name: str, db_path: str, table: str, filters: Tuple = ()) -> QueryEngine:
+    """Motor pedido si puede atender la consulta; si no, SQLite"""
+    engine = ENGINES.get(name, ENGINES['sqlite'])
+    return engine if engine.available(db_path, table, filters) else ENGINES['sqlite']
+
+def query_key(db_path: str, sql: str, params: Tuple, table: Optional[str], typed: bool, engine: str) -> tuple:
+    """Clave de un resultado en la caché de consultas (incluye la versión de los datos)"""
+    return db_path, sql, tuple(params), table, typed, data_version(db_path, table), engine
+
+def run_query(db_path: str, sql: str, params: Tuple = (), table: Optional[str] = None,
+              typed: bool = True, engine: str = 'sqlite') -> pd.DataFrame:
+    """Ejecuta query (con parámetros) con caché por versión de datos
+
+    ``table`` indica de qué tabla depende el resultado (para versionar e
+    invalidar) y, si ``typed``, qué catálogo de tipos aplicar. ``engine`` elige
+    el motor (el SQL debe estar escrito en su dialecto).
+    """
+    cache = get_query_cache()
+    profiler = get_profiler()
+    start = time.perf_counter()
+    key = query_key(db_path, sql, params, table, typed, engine)
+    df = cache.get(key)
+    if df is not None:
+        profiler.record('run_query', time.perf_counter() - start, table, sql, engine, 'hit',
+                        len(df), cache.nbytes(key))
+        return df
+    df = ENGINES[engine].read(db_path, sql, params, table)
+    parse_start = time.perf_counter()
+    if table and typed:
+        df = apply_types(df, type_catalog(db_path, table))
+    parse_s = time.perf_counter() - parse_start
+    # Solo filas de tabla: los agregados son pequeños y el código que los usa espera tipos planos
+    raw_bytes = None
+    if table and typed:
+        df, raw_bytes = compact_frame(df)
+    nbytes = cache.put(key, df, (db_path, table), raw_bytes)
+    elapsed = time.perf_counter() - start
+    plan = explain_plan(db_path, sql, params) if engine == 'sqlite' else None
+    profiler.record('run_query', elapsed, table, sql, engine, 'miss', len(df), nbytes, parse_s, plan)
+    return df.copy(deep=False)
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _table_catalog(db_path: str, version: tuple) -> Dict[str, Dict]:
+    """Catálogo de la BD para una versión (``version`` solo forma parte de la clave)
+
+    Sale de sqlite_master, PRAGMA table_info/index_list, dbstat y los catálogos
+    internos; solo cuenta filas con COUNT(*) si la tabla no tiene estadísticas.
+    """
+    start = time.perf_counter()
+    catalog = {}
+    with get_connection_manager(db_path).reader() as conn:
+        master = conn.execute("SELECT type, name, tbl_name FROM sqlite_master").fetchall()
+        try:
+            sizes = dict(conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall())
+        except sqlite3.OperationalError:
+            sizes = None  # SQLite sin dbstat
+        try:
+            kinds = conn.execute(f"SELECT tabla, columna, tipo FROM {META_PREFIX}tipos").fetchall()
+            stats = conn.execute(f"SELECT tabla, datos FROM {META_PREFIX}estadisticas").fetchall()
+        except sqlite3.OperationalError:
+            kinds, stats = [], []
+        kinds = {(t, c): k for t, c, k in kinds}
+        try:
+            encrypted = conn.execute(f"SELECT tabla, columna, sal, tipo, formato, verificador "
+                                     f"FROM {META_PREFIX}cifrado").fetchall()
+        except sqlite3.OperationalError:
+            encrypted = []
+        counts = {}
+        for t, data in stats:
+            data = json.loads(data)
+            counts.setdefault(t, data['count'] + data['nulls'])
+        
+        tables = sorted(name for kind, name, _ in master if kind == 'table' and not name.startswith('sqlite_')
+                        and not name.startswith(META_PREFIX))
+        for name in tables:
+            columns = [{'nombre': row[1], 'declarado': row[2], 'tipo': kinds.get((name, row[1]))}
+                       for row in conn.execute(f"PRAGMA table_info({quote_ident(name)})") if row[1] != ROW_ID_COL]
+            indexes = []
+            for row in conn.execute(f"PRAGMA index_list({quote_ident(name)})").fetchall():
+                cols = [c[2] for c in conn.execute(f"PRAGMA index_info({quote_ident(row[1])})")]
+                indexes.append({'nombre': row[1], 'columnas': cols, 'unico': bool(row[2])})
+            rows = counts.get(name)
+            if rows is None:
+                rows = conn.execute(f"SELECT COUNT(*) FROM {quote_ident(name)}").fetchone()[0]
+            index_names = [n for kind, n, t in master if kind == 'index' and t == name]
+            fts, blind = fts_table(name), blind_table(name)
+            blind_cols = ([row[1] for row in conn.execute(f"PRAGMA table_info({quote_ident(blind)})")][1:]
+                          if any(n == blind for _, n, _ in master) else [])
+            catalog[name] = {
+                'filas': int(rows), 'columnas': columns, 'indices': indexes,
+                'cifradas': {c: {'sal': salt, 'tipo': kind, 'formato': fmt, 'verificador': check}
+                             for t, c, salt, kind, fmt, check in encrypted if t == name},
+                'ciegas': blind_cols,
+                'bytes_datos': sizes.get(name) if sizes is not None else None,
+                'bytes_indices': (sum(sizes.get(n, 0) for n in index_names)
+                                  + sum(v for n, v in sizes.items() if n.startswith((fts, blind)))) if sizes is not None else None,
+            }
+    get_profiler().record('catalog', time.perf_counter() - start, sql="sqlite_master + PRAGMA + dbstat",
+                          filas=len(catalog))
+    return catalog
+
+def table_catalog(db_path: str) -> Dict[str, Dict]:
+    """Catálogo de tablas (filas, tamaño, columnas e índices), renovado al cambiar la versión de la BD"""
+    return _table_catalog(db_path, data_version(db_path))
+
+def list_tables(db_path: str) -> List[str]:
+    """Lista todas las tablas"""
+    return list(table_catalog(db_path))
+
+def quote_ident(name: str) -> str:
+    """Identificador SQL entre comillas dobles"""
+    return '"' + name.replace('"', '""') + '"'
+
+def table_columns(db_path: str, table: str) -> List[str]:
+    """Columnas de la tabla (sin leer datos)"""
+    entry = table_catalog(db_path).get(table)
+    if entry is not None:
+        return [c['nombre'] for c in entry['columnas']]
+    info = run_query(db_path, f'PRAGMA table_info("{table}")', table=table, typed=False)
+    return [c for c in info['name'] if c != ROW_ID_COL]
+
+def count_rows(db_path: str, table: str) -> int:
+    """Número real de filas (del catálogo, o COUNT(*) cacheado)"""
+    entry = table_catalog(db_path).get(table)
+    if entry is not None:
+        return entry['filas']
+    return int(run_query(db_path, f'SELECT COUNT(*) AS n FROM "{table}"', table=table, typed=False)['n'].iloc[0])
+
+def rowid_bounds(db_path: str, table: str) -> Optional[Tuple[int, int]]:
+    """MIN/MAX de rowid, o None si la tabla no tiene rowid"""
+    try:
+        df = run_query(db_path, f'SELECT MIN(rowid) AS lo, MAX(rowid) AS hi FROM "{table}"', table=table, typed=False)
+    except Exception:
+        return None
+    if df.empty or pd.isna(df['lo'].iloc[0]):
+        return None
+    return int(df['lo'].iloc[0]), int(df['hi'].iloc[0])
+
+class PagePrefetcher:
+    """Caché LRU de páginas con precarga de la siguiente en segundo plano"""
+
+    def __init__(self, max_pages: int = PAGE_CACHE_SIZE):
+        self.max_pages = max_pages
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self._pages: "OrderedDict[tuple, Future]" = OrderedDict()
+        self._anchors: Dict[tuple, Dict[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, loader: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        """Devuelve la página (esperando a la precarga si está en curso)"""
+        with self._lock:
+            fut = self._pages.get(key)
+            if fut is not None:
+                self._pages.move_to_end(key)
+        if fut is None:
+            fut = Future()
             try:
-                df[col] = pd.to_datetime(df[col])
-            except:
+                fut.set_result(loader())
+            except Exception as e:
+                fut.set_exception(e)
+            self._store(key, fut)
+        try:
+            return fut.result()
+        except Exception:
+            with self._lock:
+                self._pages.pop(key, None)
+            raise
+
+    def cached(self, key: tuple) -> bool:
+        """True si la página ya está guardada o precargándose"""
+        with self._lock:
+            return key in self._pages
+
+    def prefetch(self, key: tuple, loader: Callable[[], pd.DataFrame]):
+        """Lanza la carga de una página en segundo plano"""
+        with self._lock:
+            if key in self._pages:
+                return
+        self._store(key, self._executor.submit(loader))
+
+    def _store(self, key: tuple, fut: Future):
+        with self._lock:
+            self._pages[key] = fut
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+
+    def anchor(self, scope: tuple, page: int) -> Tuple[int, Optional[int]]:
+        """Ancla conocida más cercana: (página, primer rowid) con página <= page"""
+        with self._lock:
+            known = [p for p in self._anchors.get(scope, {}) if p <= page]
+            if not known:
+                return 1, None
+            best = max(known)
+            return best, self._anchors[scope][best]
+
+    def set_anchor(self, scope: tuple, page: int, rowid: int):
+        with self._lock:
+            self._anchors.setdefault(scope, {})[page] = rowid
+
+    def clear(self, db_path: str, table: str):
+        """Olvida páginas y anclas de una tabla (p. ej. tras reimportar)"""
+        with self._lock:
+            for key in [k for k in self._pages if k[:2] == (db_path, table)]:
+                del self._pages[key]
+            for scope in [k for k in self._anchors if k[:2] == (db_path, table)]:
+                del self._anchors[scope]
+
+@st.cache_resource
+def get_page_prefetcher() -> PagePrefetcher:
+    """Prefetcher compartido entre ejecuciones del script"""
+    return PagePrefetcher()
+
+def _read_page(db_path: str, table: str, columns: Tuple[str, ...], page: int, page_size: int,
+               total: int, bounds: Optional[Tuple[int, int]], catalog: Dict[str, Tuple[str, Optional[str]]],
+               version: tuple, prefetcher: PagePrefetcher) -> pd.DataFrame:
+    """Lee una página con búsqueda por rowid (keyset) en lugar de OFFSET grandes"""
+    col_sql = ", ".join(quote_ident(c) for c in columns)
+    
+    if bounds is None:
+        # Sin rowid (vistas, WITHOUT ROWID): paginación clásica
+        sql = f'SELECT {col_sql} FROM "{table}" LIMIT ? OFFSET ?'
+        with get_connection_manager(db_path).reader() as conn:
+            page_df = pd.read_sql_query(sql, conn, params=(page_size, (page - 1) * page_size))
+        return apply_types(page_df, catalog)
+    
+    lo, hi = bounds
+    scope = (db_path, table, version, page_size)
+    if hi - lo + 1 == total:
+        # rowids densos: el inicio de cada página se calcula directamente
+        start, skip = lo + (page - 1) * page_size, 0
+    else:
+        anchor_page, anchor_rowid = prefetcher.anchor(scope, page)
+        start = lo if anchor_rowid is None else anchor_rowid
+        skip = (page - anchor_page) * page_size
+    
+    sql = f'SELECT rowid AS "__rowid__", {col_sql} FROM "{table}" WHERE rowid >= ? ORDER BY rowid LIMIT ? OFFSET ?'
+    with get_connection_manager(db_path).reader() as conn:
+        page_df = pd.read_sql_query(sql, conn, params=(start, page_size, skip))
+    if not page_df.empty:
+        prefetcher.set_anchor(scope, page, int(page_df['__rowid__'].iloc[0]))
+        prefetcher.set_anchor(scope, page + 1, int(page_df['__rowid__'].iloc[-1]) + 1)
+    return apply_types(page_df.drop(columns='__rowid__'), catalog)
+
+def fetch_page(db_path: str, table: str, columns: List[str], page: int, page_size: int) -> pd.DataFrame:
+    """Devuelve la página pedida y precarga la siguiente"""
+    start = time.perf_counter()
+    catalog = type_catalog(db_path, table)
+    version = data_version(db_path, table)
+    # Sin selección, todas las columnas visibles (nunca el alias oculto de rowid)
+    cols = tuple(columns or table_columns(db_path, table))
+    
+    # Con la copia columnar lista, la página es un corte sin copia de las columnas pedidas
+    arrow_table = get_column_cache().get(db_path, table, version, catalog)
+    if arrow_table is not None:
+        projected = arrow_table.select(list(cols)) if cols else arrow_table
+        page_df = projected.slice((page - 1) * page_size, page_size).to_pandas()
+        get_profiler().record('page', time.perf_counter() - start, table, f"página {page}", 'arrow', 'hit',
+                              len(page_df), int(page_df.memory_usage(index=True, deep=True).sum()))
+        return page_df
+    
+    prefetcher = get_page_prefetcher()
+    total = count_rows(db_path, table)
+    total_pages = max(1, (total - 1) // page_size + 1)
+    bounds = rowid_bounds(db_path, table)
+    
+    def loader(p: int) -> Callable[[], pd.DataFrame]:
+        return lambda: _read_page(db_path, table, cols, p, page_size, total, bounds, catalog, version, prefetcher)
+    
+    key = (db_path, table, version, cols, page_size, page)
+    hit = prefetcher.cached(key)
+    page_df = prefetcher.get(key, loader(page))
+    if page < total_pages:
+        prefetcher.prefetch((db_path, table, version, cols, page_size, page + 1), loader(page + 1))
+    get_profiler().record('page', time.perf_counter() - start, table, f"página {page}", 'sqlite',
+                          'hit' if hit else 'miss', len(page_df),
+                          int(page_df.memory_usage(index=True, deep=True).sum()))
+    return page_df
+
+# ======================
+# Consultas en segundo plano
+# ======================
+
+class QueryJob:
+    """Consulta en segundo plano: lotes parciales, tiempo transcurrido y cancelación"""
+
+    def __init__(self, key: tuple):
+        self.key = key
+        self.status = 'running'  # running, done, cancelled, timeout, error
+        self.error: Optional[str] = None
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self._batches: List[pd.DataFrame] = []
+        self._columns: List[str] = []
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def completed(cls, key: tuple, df: pd.DataFrame) -> "QueryJob":
+        """Trabajo ya terminado (resultado servido desde la caché)"""
+        job = cls(key)
+        job._add(df)
+        job._finish('done')
+        return job
+
+    def cancel(self):
+        self._cancel.set()
+
+    def running(self) -> bool:
+        return self.status == 'running'
+
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def rows(self) -> int:
+        with self._lock:
+            return sum(len(b) for b in self._batches)
+
+    def result(self) -> pd.DataFrame:
+        """Filas recibidas hasta ahora (todas, si ha terminado)"""
+        with self._lock:
+            batches, columns = list(self._batches), self._columns
+        if not batches:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(batches, ignore_index=True) if len(batches) > 1 else batches[0]
+
+    def _add(self, df: pd.DataFrame):
+        with self._lock:
+            self._batches.append(df)
+            self._columns = list(df.columns)
+
+    def _finish(self, status: str, error: Optional[str] = None):
+        self.error = error
+        self.finished = time.perf_counter()
+        self.status = status
+
+class QueryRunner:
+    """Pool de hilos para consultas SQLite interrumpibles
+
+    Cada consulta instala un progress handler que la aborta si se cancela o
+    supera su tiempo máximo; las filas llegan en lotes de QUERY_BATCH_ROWS.
+    """
+
+    def __init__(self, workers: int = QUERY_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query")
+
+    def submit(self, job: QueryJob, db_path: str, sql: str, params: Tuple, timeout_s: float,
+               prepare: Callable[[pd.DataFrame], pd.DataFrame], on_done: Callable[[pd.DataFrame], None]) -> QueryJob:
+        self._executor.submit(self._run, job, db_path, sql, params, timeout_s, prepare, on_done)
+        return job
+
+    def _run(self, job: QueryJob, db_path: str, sql: str, params: Tuple, timeout_s: float,
+             prepare: Callable[[pd.DataFrame], pd.DataFrame], on_done: Callable[[pd.DataFrame], None]):
+        deadline = time.perf_counter() + timeout_s
+        
+        def interrupt() -> int:
+            return int(job._cancel.is_set() or time.perf_counter() > deadline)
+        
+        try:
+            with get_connection_manager(db_path).reader() as conn:
+                conn.set_progress_handler(interrupt, QUERY_PROGRESS_OPS)
                 try:
-                    df[col] = pd.to_numeric(df[col])
-                except:
+                    cursor = conn.execute(sql, params)
+                    columns = [d[0] for d in cursor.description]
+                    while True:
+                        rows = cursor.fetchmany(QUERY_BATCH_ROWS)
+                        if not rows:
+                            break
+                        job._add(prepare(pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)))
+                        if interrupt():
+                            raise sqlite3.OperationalError("interrupted")
+                    if not job.rows:
+                        job._add(pd.DataFrame(columns=columns))
+                finally:
+                    conn.set_progress_handler(None, 0)
+        except sqlite3.OperationalError as e:
+            if job._cancel.is_set():
+                job._finish('cancelled')
+            elif time.perf_counter() > deadline:
+                job._finish('timeout')
+            else:
+                job._finish('error', str(e))
+            return
+        except Exception as e:
+            job._finish('error', str(e))
+            return
+        on_done(job.result())
+        job._finish('done')
+
+@st.cache_resource
+def get_query_runner() -> QueryRunner:
+    """Pool de consultas en segundo plano compartido entre ejecuciones del script"""
+    return QueryRunner()
+
+def run_query_async(db_path: str, sql: str, params: Tuple = (), table: Optional[str] = None,
+                    typed: bool = True, timeout_s: float = QUERY_TIMEOUT_S) -> QueryJob:
+    """Como ``run_query`` (SQLite) pero en segundo plano; el resultado final entra en la caché"""
+    cache = get_query_cache()
+    key = query_key(db_path, sql, params, table, typed, 'sqlite')
+    df = cache.get(key)
+    if df is not None:
+        return QueryJob.completed(key, df)
+    # El catálogo y el plan se leen aquí: los hilos del pool no usan las cachés de Streamlit
+    catalog = type_catalog(db_path, table) if table and typed else {}
+    profiler, plan, job = get_profiler(), explain_plan(db_path, sql, params), QueryJob(key)
+    
+    def done(df: pd.DataFrame):
+        raw_bytes = None
+        if table and typed:
+            df, raw_bytes = compact_frame(df)
+        nbytes = cache.put(key, df, (db_path, table), raw_bytes)
+        profiler.record('async', job.elapsed(), table, sql, 'sqlite', 'miss', len(df), nbytes, plan=plan)
+    
+    return get_query_runner().submit(job, db_path, sql, tuple(params), timeout_s,
+                                     lambda batch: apply_types(batch, catalog), done)
+
+def session_query(state_key: str, db_path: str, sql: str, params: Tuple = (), table: Optional[str] = None,
+                  typed: bool = True) -> QueryJob:
+    """Trabajo de la sesión para esta consulta: reutiliza el actual o cancela el anterior"""
+    job = st.session_state.get(state_key)
+    if job is not None and job.key == query_key(db_path, sql, params, table, typed, 'sqlite'):
+        return job
+    if job is not None:
+        job.cancel()
+    job = run_query_async(db_path, sql, params, table, typed,
+                          st.session_state.get('query_timeout', QUERY_TIMEOUT_S))
+    st.session_state[state_key] = job
+    return job
+
+def show_query_job(state_key: str, render: Callable[[pd.DataFrame], None]):
+    """Progreso de un trabajo de la sesión: tiempo, botón de cancelar y resultados parciales"""
+    job = st.session_state.get(state_key)
+    if job is None:
+        return
+    polling = job.running()
+    
+    @st.fragment(run_every=QUERY_POLL_S if polling else None)
+    def panel():
+        if job.running():
+            col1, col2 = st.columns([5, 1])
+            col1.caption(f"⏳ Consultando… {job.elapsed():.1f} s • {job.rows:,} filas recibidas")
+            if col2.button("⏹️ Cancelar", key=f"{state_key}_cancel"):
+                job.cancel()
+            if job.rows:
+                render(job.result())
+            return
+        if polling:
+            # Terminó durante el refresco parcial: se redibuja la página entera
+            st.rerun()
+        if job.status == 'done':
+            render(job.result())
+            return
+        if job.status == 'cancelled':
+            st.warning(f"⏹️ Consulta cancelada a los {job.elapsed():.1f} s")
+        elif job.status == 'timeout':
+            st.error(f"⌛ La consulta superó el tiempo máximo ({job.elapsed():.0f} s)")
+        else:
+            st.error(f"❌ Error en la consulta: {job.error}")
+        if job.rows:
+            st.caption(f"Resultados parciales: {job.rows:,} filas")
+            render(job.result())
+        if st.button("🔁 Reintentar", key=f"{state_key}_retry"):
+            del st.session_state[state_key]
+            st.rerun()
+    
+    panel()
+
+# ======================
+# Caché columnar (Arrow)
+# ======================
+
+def arrow_schema(catalog: Dict[str, Tuple[str, Optional[str]]]):
+    """Esquema Arrow a partir del catálogo de tipos"""
+    import pyarrow as pa
+    
+    arrow_types = {'integer': pa.int64(), 'real': pa.float64(), 'date': pa.timestamp('ns'),
+                   'datetime': pa.timestamp('ns'), 'text': pa.string(), 'encrypted': pa.binary()}
+    return pa.schema([(col, arrow_types[kind]) for col, (kind, _) in catalog.items()])
+
+def arrow_catalog(db_path: str, table: str,
+                  catalog: Dict[str, Tuple[str, Optional[str]]]) -> Dict[str, Tuple[str, Optional[str]]]:
+    """Catálogo para escribir en Arrow: las columnas 'integer' con decimales pasan a 'real'
+
+    El tipo se infiere con el primer lote y el esquema Arrow es fijo para todo
+    el fichero, así que se comprueba la tabla entera en una sola pasada.
+    """
+    integer = [col for col, (kind, _) in catalog.items() if kind == 'integer']
+    if not integer:
+        return catalog
+    checks = ", ".join(f"MAX(typeof({c}) = 'real' AND {c} <> CAST({c} AS INTEGER))"
+                       for c in map(quote_ident, integer))
+    with get_connection_manager(db_path).reader() as conn:
+        fractional = conn.execute(f"SELECT {checks} FROM {quote_ident(table)}").fetchone()
+    return {**catalog, **{col: ('real', None) for col, frac in zip(integer, fractional) if frac}}
+
+class ColumnCache:
+    """Copia columnar de cada tabla por versión de datos (Arrow IPC sin comprimir)
+
+    El fichero se genera una sola vez en segundo plano y se abre con memory-map:
+    leer una página solo toca las columnas y filas pedidas. Mientras no está
+    listo (o si pyarrow no está instalado) ``get`` devuelve None y se lee de SQLite.
+    """
+
+    def __init__(self, directory: str = COLUMN_CACHE_DIR, max_open: int = COLUMN_CACHE_OPEN):
+        self.directory = directory
+        self.max_open = max_open
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="columnar")
+        self._builds: Dict[str, Future] = {}
+        self._open: "OrderedDict[str, object]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prefix(self, db_path: str, table: str) -> str:
+        key = repr((os.path.abspath(db_path), table))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+    def path(self, db_path: str, table: str, version: tuple) -> str:
+        suffix = hashlib.sha1(repr(version).encode('utf-8')).hexdigest()[:8]
+        return os.path.join(self.directory, f"{self._prefix(db_path, table)}_{suffix}.arrow")
+
+    def get(self, db_path: str, table: str, version: tuple, catalog: Dict[str, Tuple[str, Optional[str]]]):
+        """Tabla Arrow mapeada en memoria, o None si aún no está disponible"""
+        if not COLUMN_CACHE:
+            return None
+        try:
+            import pyarrow as pa
+        except ImportError:
+            return None
+        
+        path = self.path(db_path, table, version)
+        with self._lock:
+            arrow_table = self._open.get(path)
+            if arrow_table is not None:
+                self._open.move_to_end(path)
+                return arrow_table
+            fut = self._builds.get(path)
+            if fut is None and not os.path.exists(path):
+                self._builds[path] = self._executor.submit(self._build, db_path, table, catalog, path)
+                return None
+        if fut is not None and (not fut.done() or fut.exception() is not None):
+            return None
+        
+        arrow_table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        with self._lock:
+            self._open[path] = arrow_table
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return arrow_table
+
+    def ready(self, db_path: str, table: str, version: tuple) -> bool:
+        """True si la página se leerá de la copia columnar"""
+        with self._lock:
+            return self.path(db_path, table, version) in self._open
+
+    def _build(self, db_path: str, table: str, catalog: Dict[str, Tuple[str, Optional[str]]], path: str):
+        import pyarrow as pa
+        
+        os.makedirs(self.directory, exist_ok=True)
+        catalog = arrow_catalog(db_path, table, catalog)
+        schema = arrow_schema(catalog)
+        tmp_path = path + ".part"
+        try:
+            # Un record batch por lote; sin compresión para poder mapear sin copiar
+            with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+                for chunk in iter_table_chunks(db_path, table, (), typed=False):
+                    chunk = apply_types(chunk, catalog)
+                    writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        # Versiones anteriores de la misma tabla
+        prefix = os.path.basename(path).split('_')[0]
+        for name in os.listdir(self.directory):
+            old = os.path.join(self.directory, name)
+            if name.startswith(prefix) and old != path:
+                try:
+                    os.remove(old)
+                except OSError:
                     pass
-    return df
+
+    def clear(self, db_path: str, table: str):
+        """Cierra las copias abiertas de la tabla (tras una reimportación)"""
+        prefix = os.path.join(self.directory, self._prefix(db_path, table))
+        with self._lock:
+            for path in [p for p in self._open if p.startswith(prefix)]:
+                del self._open[path]
+    
+    def purge(self, db_path: str, table: str):
+        """Cierra y borra del disco las copias de la tabla (p. ej. con valores ya cifrados en la BD)"""
+        self.clear(db_path, table)
+        prefix = self._prefix(db_path, table)
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.startswith(prefix):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except OSError:
+                        pass
+
+@st.cache_resource
+def get_column_cache() -> ColumnCache:
+    """Caché columnar compartida entre ejecuciones del script"""
+    return ColumnCache()
+
+# ======================
+# Catálogo de tipos
+# ======================
+
+# Formatos de fecha reconocidos (se prueba con formato explícito, nunca "a ciegas")
+DATE_FORMATS = ['ISO8601', '%d/%m/%Y', '%d/%m/%Y %H:%M', '%d/%m/%Y %H:%M:%S', '%d-%m-%Y', '%Y/%m/%d']
+STORAGE_FORMATS = {'date': '%Y-%m-%d', 'datetime': '%Y-%m-%d %H:%M:%S'}
+# Formatos que SQLite ordena bien como texto (MIN/MAX, rangos, strftime)
+ISO_FORMATS = ('ISO8601', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S')
+KIND_GROUPS = {'integer': 'numeric', 'real': 'numeric', 'date': 'datetime', 'datetime': 'datetime', 'text': 'text',
+               'encrypted': 'encrypted'}
+
+def ensure_meta_tables(conn: sqlite3.Connection):
+    """Crea las tablas internas de metadatos si no existen"""
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {META_PREFIX}tipos (
+        tabla TEXT NOT NULL, columna TEXT NOT NULL, tipo TEXT NOT NULL, formato TEXT,
+        PRIMARY KEY (tabla, columna))""")
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {META_PREFIX}versiones (
+        tabla TEXT PRIMARY KEY, version INTEGER NOT NULL)""")
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {META_PREFIX}estadisticas (
+        tabla TEXT NOT NULL, columna TEXT NOT NULL, datos TEXT NOT NULL,
+        PRIMARY KEY (tabla, columna))""")
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {META_PREFIX}uso (
+        tabla TEXT NOT NULL, columnas TEXT NOT NULL, uso TEXT NOT NULL, veces INTEGER NOT NULL,
+        consulta TEXT NOT NULL, parametros TEXT NOT NULL,
+        PRIMARY KEY (tabla, columnas, uso))""")
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {META_PREFIX}indices (
+        nombre TEXT PRIMARY KEY, tabla TEXT NOT NULL, columnas TEXT NOT NULL,
+        antes_ms REAL, despues_ms REAL, bytes INTEGER, creado TEXT)""")
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {META_PREFIX}cifrado (
+        tabla TEXT NOT NULL, columna TEXT NOT NULL, sal BLOB NOT NULL, tipo TEXT NOT NULL, formato TEXT,
+        verificador BLOB NOT NULL, PRIMARY KEY (tabla, columna))""")
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {META_PREFIX}claves (
+        uso TEXT PRIMARY KEY, sal BLOB NOT NULL)""")
+
+def save_type_catalog(conn: sqlite3.Connection, table: str, schema: Dict[str, Tuple[str, Optional[str]]]):
+    """Guarda el catálogo de tipos de una tabla (dentro de la transacción del llamador)"""
+    conn.execute(f"DELETE FROM {META_PREFIX}tipos WHERE tabla = ?", (table,))
+    conn.executemany(f"INSERT INTO {META_PREFIX}tipos VALUES (?, ?, ?, ?)",
+                     [(table, col, kind, fmt) for col, (kind, fmt) in schema.items()])
+
+def detect_date_format(s: pd.Series) -> Optional[str]:
+    """Primer formato de DATE_FORMATS que encaja con todos los valores, o None"""
+    values = s.astype(str)
+    for fmt in DATE_FORMATS:
+        # Criba rápida con los primeros valores antes de validar la columna entera
+        if pd.to_datetime(values.head(200), format=fmt, errors='coerce').isna().any():
+            continue
+        if pd.to_datetime(values, format=fmt, errors='coerce').notna().all():
+            return fmt
+    return None
 
 @st.cache_data(ttl=300)
-def list_tables(db_path: str) -> List[str]:
-    """Lista todas las tablas"""
-    sql = "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
-    df = run_query(db_path, sql)
-    return df['name'].tolist() if not df.empty else []
+def type_catalog(db_path: str, table: str) -> Dict[str, Tuple[str, Optional[str]]]:
+    """Catálogo de tipos persistido: {columna: (tipo, formato)}
 
-def import_csv_to_db(csv_file, db_path: str, table_name: str):
-    """Importa CSV a SQLite"""
-    try:
-        df = pd.read_csv(csv_file, encoding='utf-8')
-    except:
-        df = pd.read_csv(csv_file, encoding='latin-1')
+    Si la tabla aún no tiene catálogo (BD creada fuera de la app) se infiere una
+    vez a partir de una muestra y se guarda en la propia BD.
+    """
+    manager = get_connection_manager(db_path)
+    cols = table_columns(db_path, table)
+    with manager.reader() as conn:
+        try:
+            rows = conn.execute(f"SELECT columna, tipo, formato FROM {META_PREFIX}tipos WHERE tabla = ?",
+                                (table,)).fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        catalog = {col: (kind, fmt) for col, kind, fmt in rows}
+        if set(cols) <= set(catalog):
+            return {col: catalog[col] for col in cols}
+        cols_sql = ", ".join(map(quote_ident, cols))
+        catalog = infer_schema(pd.read_sql_query(f'SELECT {cols_sql} FROM "{table}" LIMIT 1000', conn))
     
-    conn = get_sqlite_connection(db_path)
-    df.to_sql(table_name, conn, if_exists='replace', index=False)
+    try:
+        with manager.writer(timeout=WRITER_TIMEOUT_S) as wconn:
+            wconn.execute("BEGIN")
+            ensure_meta_tables(wconn)
+            save_type_catalog(wconn, table, catalog)
+            wconn.execute("COMMIT")
+    except (sqlite3.Error, TimeoutError):
+        pass  # BD de solo lectura u ocupada: se usa el catálogo en memoria
+    return catalog
+
+def apply_types(df: pd.DataFrame, catalog: Dict[str, Tuple[str, Optional[str]]]) -> pd.DataFrame:
+    """Conversión vectorizada con el tipo y formato ya conocidos (sin probar y fallar)"""
+    for col in df.columns:
+        kind, fmt = catalog.get(col, (None, None))
+        if kind in ('date', 'datetime') and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col], format=fmt, errors='coerce')
+        elif kind in ('integer', 'real') and df[col].dtype == 'object':
+            df[col] = pd.to_numeric(df[col], errors='coerce')
     return df
 
-def download_data(df: pd.DataFrame, format: str) -> bytes:
-    """Genera archivo descargable"""
-    if format == 'csv':
-        return df.to_csv(index=False).encode('utf-8')
-    elif format == 'excel':
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='Datos')
-        return output.getvalue()
-    elif format == 'parquet':
-        output = io.BytesIO()
-        df.to_parquet(output, index=False)
-        return output.getvalue()
+# ======================
+# Catálogo de estadísticas
+# ======================
+
+KMV_K = 1024        # tamaño del sketch de valores distintos (error típico ~3 %)
+TOP_TRACKED = 1000  # candidatos a "más frecuente" que se siguen por columna
+
+class ColumnStats:
+    """Estadísticas de una columna acumuladas lote a lote (una sola pasada)
+
+    Nulos, min/max, media y desviación (fusión de momentos de Chan), valores
+    distintos aproximados (sketch KMV) y valores más frecuentes.
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.count = 0
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self.n_num = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.sketch = np.empty(0, dtype=np.uint64)
+        self.top: Dict = {}
+
+    def update(self, s: pd.Series):
+        nulls = int(s.isna().sum())
+        self.nulls += nulls
+        self.count += len(s) - nulls
+        s = s.dropna()
+        if s.empty or self.kind == 'encrypted':
+            return  # de una columna cifrada solo se cuentan valores y nulos
+        
+        if KIND_GROUPS[self.kind] == 'numeric':
+            values = pd.to_numeric(s, errors='coerce').dropna().astype('float64')
+            if len(values):
+                n_b, mean_b = len(values), float(values.mean())
+                m2_b = float(((values - mean_b) ** 2).sum())
+                n = self.n_num + n_b
+                delta = mean_b - self.mean
+                self.mean += delta * n_b / n
+                self.m2 += m2_b + delta ** 2 * self.n_num * n_b / n
+                self.n_num = n
+                lo, hi = float(values.min()), float(values.max())
+            s = values
+        else:
+            s = s.astype(str)
+            lo, hi = s.min(), s.max()
+        if len(s):
+            self.min = lo if self.min is None else min(self.min, lo)
+            self.max = hi if self.max is None else max(self.max, hi)
+        
+        hashes = pd.util.hash_pandas_object(s, index=False).to_numpy(dtype=np.uint64)
+        self.sketch = np.unique(np.concatenate([self.sketch, hashes]))[:KMV_K]
+        
+        for value, n in s.value_counts().items():
+            self.top[value] = self.top.get(value, 0) + int(n)
+        if len(self.top) > TOP_TRACKED:
+            self.top = dict(sorted(self.top.items(), key=lambda kv: -kv[1])[:TOP_TRACKED])
+
+    def distinct(self) -> int:
+        """Valores distintos: exacto hasta KMV_K, estimado a partir de ahí"""
+        if len(self.sketch) < KMV_K:
+            return len(self.sketch)
+        return int((KMV_K - 1) / (float(self.sketch[-1]) / 2.0 ** 64))
+
+    def _display(self, value):
+        """Los enteros se acumulan como float: se devuelven como int"""
+        if self.kind == 'integer' and isinstance(value, float) and value.is_integer():
+            return int(value)
+        return value
+
+    def result(self) -> Dict:
+        numeric = KIND_GROUPS[self.kind] == 'numeric'
+        top = sorted(self.top.items(), key=lambda kv: -kv[1])[:STATS_TOP_VALUES]
+        return {
+            'tipo': self.kind,
+            'count': self.count,
+            'nulls': self.nulls,
+            'min': self._display(self.min),
+            'max': self._display(self.max),
+            'mean': self.mean if numeric and self.n_num else None,
+            'std': math.sqrt(self.m2 / (self.n_num - 1)) if numeric and self.n_num > 1 else None,
+            'distinct': self.distinct() if self.kind != 'encrypted' else None,
+            'top': [[self._display(value), n] for value, n in top],
+            'hist': None,
+        }
+
+def histogram_query(table: str, col: str, lo: float, hi: float, bins: int,
+                    where: str = "", params: Tuple = (), engine: Optional[QueryEngine] = None) -> Tuple[str, Tuple]:
+    """SQL de un histograma de anchura fija: una fila (bin, n) por barra no vacía"""
+    engine = engine or ENGINES['sqlite']
+    c = quote_ident(col)
+    width = (hi - lo) / bins if hi > lo else 1.0
+    cond = f"{c} IS NOT NULL AND {engine.is_number(c)}"
+    where = f"{where} AND {cond}" if where else f" WHERE {cond}"
+    sql = (f'SELECT {engine.bucket(f"({c} - ?) / ?", "?")} AS bin, COUNT(*) AS n '
+           f'FROM "{table}"{where} GROUP BY bin ORDER BY bin')
+    return sql, (lo, width, bins - 1) + tuple(params)
+
+def finish_stats(conn: sqlite3.Connection, table: str, accumulators: Dict[str, ColumnStats]) -> Dict[str, Dict]:
+    """Cierra los acumuladores y añade histogramas (con el rango ya conocido)"""
+    stats = {}
+    for col, acc in accumulators.items():
+        result = acc.result()
+        if KIND_GROUPS[acc.kind] == 'numeric' and result['min'] is not None:
+            lo, hi = result['min'], result['max']
+            sql, params = histogram_query(table, col, lo, hi, STATS_HIST_BINS)
+            counts = [0] * STATS_HIST_BINS
+            for b, n in conn.execute(sql, params):
+                counts[int(b)] = n
+            width = (hi - lo) / STATS_HIST_BINS if hi > lo else 1.0
+            result['hist'] = {'edges': [lo + i * width for i in range(STATS_HIST_BINS + 1)], 'counts': counts}
+        stats[col] = result
+    return stats
+
+def save_stats_catalog(conn: sqlite3.Connection, table: str, stats: Dict[str, Dict]):
+    """Guarda el catálogo de estadísticas (dentro de la transacción del llamador)"""
+    conn.execute(f"DELETE FROM {META_PREFIX}estadisticas WHERE tabla = ?", (table,))
+    conn.executemany(f"INSERT INTO {META_PREFIX}estadisticas VALUES (?, ?, ?)",
+                     [(table, col, json.dumps(data, default=str)) for col, data in stats.items()])
+
+@st.cache_data(ttl=300, show_spinner="Calculando estadísticas de la tabla...")
+def stats_catalog(db_path: str, table: str) -> Dict[str, Dict]:
+    """Estadísticas por columna de la tabla completa
+
+    Se calculan al importar; para tablas que no pasaron por el importador se
+    calculan una vez recorriendo la tabla por lotes y se guardan en la BD.
+    """
+    manager = get_connection_manager(db_path)
+    cols = table_columns(db_path, table)
+    with manager.reader() as conn:
+        try:
+            rows = conn.execute(f"SELECT columna, datos FROM {META_PREFIX}estadisticas WHERE tabla = ?",
+                                (table,)).fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+    stats = {col: json.loads(data) for col, data in rows}
+    if set(cols) <= set(stats):
+        return {col: stats[col] for col in cols}
+    
+    catalog = type_catalog(db_path, table)
+    accumulators = {col: ColumnStats(catalog[col][0]) for col in cols}
+    cols_sql = ", ".join(map(quote_ident, cols))
+    with manager.reader() as conn:
+        for chunk in pd.read_sql_query(f'SELECT {cols_sql} FROM "{table}"', conn, chunksize=EXPORT_CHUNK_ROWS):
+            for col, acc in accumulators.items():
+                acc.update(chunk[col])
+        stats = finish_stats(conn, table, accumulators)
+    try:
+        with manager.writer(timeout=WRITER_TIMEOUT_S) as wconn:
+            wconn.execute("BEGIN")
+            ensure_meta_tables(wconn)
+            save_stats_catalog(wconn, table, stats)
+            wconn.execute("COMMIT")
+    except (sqlite3.Error, TimeoutError):
+        pass  # BD de solo lectura u ocupada: se usan las estadísticas en memoria
+    return stats
+
+# ======================
+# Filtros en SQL
+# ======================
+
+def column_kinds(db_path: str, table: str) -> Dict[str, str]:
+    """Tipo de cada columna ('numeric', 'datetime' o 'text') según el catálogo
+
+    Las fechas guardadas en otro formato (p. ej. dd/mm/aaaa en una BD creada
+    fuera de la app) se filtran como texto: en SQL se comparan carácter a carácter.
+    """
+    return {col: 'text' if KIND_GROUPS[kind] == 'datetime' and fmt not in ISO_FORMATS else KIND_GROUPS[kind]
+            for col, (kind, fmt) in type_catalog(db_path, table).items()}
+
+def column_bounds(db_path: str, table: str, col: str) -> Tuple:
+    """MIN y MAX de una columna (cacheado); en las numéricas solo cuentan los números"""
+    c = quote_ident(col)
+    kind, fmt = type_catalog(db_path, table).get(col, (None, None))
+    # Los valores que no encajaron en el tipo se guardaron tal cual ('desconocido'...)
+    where, params = build_where((('numeric', col),)) if KIND_GROUPS.get(kind) == 'numeric' else ("", ())
+    df = run_query(db_path, f'SELECT MIN({c}) AS lo, MAX({c}) AS hi FROM "{table}"{where}', params,
+                   table=table, typed=False)
+    lo, hi = df['lo'].iloc[0], df['hi'].iloc[0]
+    if kind in ('date', 'datetime') and fmt in ISO_FORMATS and not pd.isna(lo):
+        lo, hi = pd.to_datetime(lo, format=fmt), pd.to_datetime(hi, format=fmt)
+    return lo, hi
+
+def distinct_values(db_path: str, table: str, col: str, limit: int = MAX_CATEGORIES) -> Optional[List]:
+    """Valores distintos de una columna, o None si hay más de ``limit``"""
+    c = quote_ident(col)
+    df = run_query(db_path, f'SELECT DISTINCT {c} AS v FROM "{table}" WHERE {c} IS NOT NULL LIMIT ?',
+                   (limit + 1,), table=table, typed=False)
+    return df['v'].tolist() if len(df) <= limit else None
+
+def build_where(filters: Tuple, engine: Optional[QueryEngine] = None) -> Tuple[str, Tuple]:
+    """Compila los filtros en un WHERE parametrizado (unidos con AND)
+
+    Cada filtro es una tupla:
+        ('range', col, min, max)      → col BETWEEN min AND max
+        ('date', col, desde, hasta)   → col >= desde AND col < hasta (ISO-8601)
+        ('in', col, (v1, v2, ...))    → col IN (...)
+        ('contains', col, texto)      → col LIKE '%texto%'
+        ('match', col, consulta, fts) → rowid en el índice FTS5 ``fts``
+        ('blind', col, (h1, ...), tabla) → rowid en el índice ciego (HMAC) de ``tabla``
+        ('notnull', col)              → col IS NOT NULL
+        ('numeric', col)              → solo valores numéricos
+    """
+    engine = engine or ENGINES['sqlite']
+    clauses, params = [], []
+    for kind, col, *args in filters:
+        c = quote_ident(col)
+        if kind == 'range':
+            clauses.append(f"{c} BETWEEN ? AND ?")
+            params.extend(args)
+        elif kind == 'date':
+            clauses.append(f"{c} >= ? AND {c} < ?")
+            params.extend(args)
+        elif kind == 'in':
+            values = args[0]
+            if not values:
+                clauses.append("0")
+                continue
+            clauses.append(f"{c} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+        elif kind == 'notnull':
+            clauses.append(f"{c} IS NOT NULL")
+        elif kind == 'numeric':
+            clauses.append(engine.is_number(c))
+        elif kind == 'contains':
+            term = args[0].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            clauses.append(f"{c} LIKE ? ESCAPE '\\'")
+            params.append(f"%{term}%")
+        elif kind == 'match':
+            fts = quote_ident(args[1])
+            clauses.append(f"rowid IN (SELECT rowid FROM {fts} WHERE {fts} MATCH ?)")
+            params.append(args[0])
+        elif kind == 'blind':
+            digests, source = args
+            index = quote_ident(blind_table(source))
+            clauses.append(f"{quote_ident(source)}.rowid IN (SELECT fila FROM {index} "
+                           f"WHERE {c} IN ({', '.join('?' * len(digests))}))")
+            params.extend(digests)
+        else:
+            raise ValueError(f"Filtro desconocido: {kind}")
+    if not clauses:
+        return "", ()
+    return " WHERE " + " AND ".join(clauses), tuple(params)
+
+def count_filtered(db_path: str, table: str, filters: Tuple, observe: bool = False) -> int:
+    """Número de filas que cumplen los filtros
+
+    Con ``observe`` el asesor de índices anota los filtros como uso real
+    (solo los de la pestaña de filtros, no rangos internos como el zoom).
+    """
+    require_plain(db_path, table, [f[1] for f in filters if f[0] != 'blind'])
+    where, params = build_where(filters)
+    sql = f'SELECT COUNT(*) AS n FROM "{table}"{where}'
+    if observe:
+        observe_filters(db_path, table, filters, sql, params)
+    return int(run_query(db_path, sql, params, table=table, typed=False)['n'].iloc[0])
+
+# ======================
+# Búsqueda de texto (FTS5)
+# ======================
+
+FTS_TOKENIZER = "unicode61 remove_diacritics 2"  # sin mayúsculas ni tildes
+
+def fts_table(table: str) -> str:
+    """Nombre del índice FTS5 de una tabla"""
+    return f"{META_PREFIX}fts_{table}"
+
+def build_fts_index(conn: sqlite3.Connection, source: str, index: str, columns: List[str]) -> bool:
+    """Crea un índice FTS5 sin contenido (solo rowid) para ``columns`` de ``source``
+
+    Devuelve False si esta versión de SQLite no incluye FTS5.
+    """
+    cols = ", ".join(quote_ident(c) for c in columns)
+    conn.execute(f"DROP TABLE IF EXISTS {quote_ident(index)}")
+    try:
+        conn.execute(f"CREATE VIRTUAL TABLE {quote_ident(index)} USING fts5({cols}, content='', "
+                     f"tokenize='{FTS_TOKENIZER}')")
+    except sqlite3.OperationalError:
+        return False
+    conn.execute("BEGIN")
+    conn.execute(f"INSERT INTO {quote_ident(index)}(rowid, {cols}) SELECT rowid, {cols} FROM {quote_ident(source)}")
+    conn.execute("COMMIT")
+    return True
+
+def fts_columns(db_path: str, table: str) -> List[str]:
+    """Columnas con índice de texto completo (vacío si la tabla no tiene índice)"""
+    info = run_query(db_path, f"PRAGMA table_info({quote_ident(fts_table(table))})", table=table, typed=False)
+    return info['name'].tolist() if not info.empty else []
+
+def fts_query(col: str, text: str) -> Optional[str]:
+    """Consulta FTS5 por prefijo de cada palabra del texto, limitada a la columna"""
+    tokens = re.findall(r"\w+", text)
+    if not tokens:
+        return None
+    terms = " ".join(f'"{t}"*' for t in tokens)
+    return f'{{{quote_ident(col)}}} : ({terms})'
+
+def fts_ranking(table: str, filters: Tuple) -> Tuple[str, str, Tuple, Tuple]:
+    """JOIN y ORDER BY por relevancia (bm25) de las búsquedas de texto de los filtros
+
+    Devuelve (join, order, parámetros del join, filtros restantes). Las búsquedas
+    sobre el mismo índice se combinan con AND en un único MATCH unido por JOIN.
+    """
+    matches = [f for f in filters if f[0] == 'match']
+    if not matches:
+        return "", "", (), filters
+    index = matches[0][3]
+    query = " AND ".join(f"({f[2]})" for f in matches if f[3] == index)
+    rest = tuple(f for f in filters if not (f[0] == 'match' and f[3] == index))
+    fts = quote_ident(index)
+    join = (f" JOIN (SELECT rowid AS _fts_id, rank AS _fts_rank FROM {fts} WHERE {fts} MATCH ?) "
+            f'ON _fts_id = "{table}".rowid')
+    return join, " ORDER BY _fts_rank", (query,), rest
+
+# ======================
+# Columnas cifradas
+# ======================
+
+ENCRYPTION_CHECK = b"explorador"  # texto cifrado en la metadata para comprobar la clave
+
+def crypto_available() -> bool:
+    """True si está instalado ``cryptography`` (necesario para Database.db_crypto)"""
+    try:
+        import Database.db_crypto  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def encrypted_columns(db_path: str, table: str) -> Dict[str, Dict]:
+    """Columnas cifradas de la tabla: {columna: {sal, tipo, formato, verificador}}"""
+    return table_catalog(db_path).get(table, {}).get('cifradas', {})
+
+def blind_table(table: str) -> str:
+    """Tabla con los índices ciegos (HMAC por columna cifrada) de una tabla"""
+    return f"{META_PREFIX}ciego_{table}"
+
+def blind_columns(db_path: str, table: str) -> List[str]:
+    """Columnas cifradas con índice ciego (se pueden filtrar por igualdad)"""
+    return table_catalog(db_path).get(table, {}).get('ciegas', [])
+
+def blind_salt(conn: sqlite3.Connection, create: bool = False) -> Optional[bytes]:
+    """Sal de los índices ciegos, común a toda la BD (None si aún no hay ninguno)"""
+    try:
+        row = conn.execute(f"SELECT sal FROM {META_PREFIX}claves WHERE uso = 'indice_ciego'").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    if row is None and create:
+        from Database.db_crypto import new_salt
+        
+        row = (new_salt(),)
+        conn.execute(f"INSERT INTO {META_PREFIX}claves VALUES ('indice_ciego', ?)", row)
+    return row[0] if row else None
+
+def blind_key(passphrase: str, salt: bytes, col: str) -> bytearray:
+    """Clave HMAC del índice ciego de una columna (HKDF desde la clave y la sal de la BD)
+
+    La sal no es la de la columna y la etiqueta es el nombre de la columna:
+    columnas con el mismo nombre y la misma clave dan el mismo HMAC en
+    cualquier tabla, así que se pueden unir por sus índices ciegos.
+    """
+    from Database.db_crypto import KeySession
+    
+    return KeySession(passphrase, salt).subkey(f"blind-index:{col}")
+
+def build_blind_index(conn: sqlite3.Connection, table: str, col: str, passphrase: str):
+    """Escribe el HMAC de cada valor en claro de ``col`` y lo indexa (dentro de la transacción del llamador)
+
+    Se llama antes de cifrar la columna: es la única pasada que ve los valores en claro.
+    """
+    from Database.db_crypto import blind_index_many
+    
+    index, c = quote_ident(blind_table(table)), quote_ident(col)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {index} (fila INTEGER PRIMARY KEY)")
+    conn.execute(f"ALTER TABLE {index} ADD COLUMN {c} BLOB")
+    key = blind_key(passphrase, blind_salt(conn, create=True), col)
+    last = None
+    while True:
+        where = "WHERE rowid > ? " if last is not None else ""
+        rows = conn.execute(f'SELECT rowid, {c} FROM "{table}" {where}ORDER BY rowid LIMIT ?',
+                            ((last,) if last is not None else ()) + (IMPORT_CHUNK_ROWS,)).fetchall()
+        if not rows:
+            break
+        digests = blind_index_many([r[1] for r in rows], key)
+        conn.executemany(f"INSERT INTO {index} (fila, {c}) VALUES (?, ?) "
+                         f"ON CONFLICT(fila) DO UPDATE SET {c} = excluded.{c}",
+                         zip([r[0] for r in rows], digests))
+        last = rows[-1][0]
+    key[:] = bytes(len(key))
+    digest = hashlib.sha1(col.encode('utf-8')).hexdigest()[:8]
+    conn.execute(f"CREATE INDEX {quote_ident(f'{blind_table(table)}_{digest}')} ON {index} ({c})")
+
+def blind_filter(db_path: str, table: str, col: str, values: List[str]) -> Optional[Tuple]:
+    """Filtro de igualdad sobre el índice ciego, o None sin la clave correcta"""
+    from Database.db_crypto import blind_index
+    
+    passphrase = current_passphrase()
+    if column_session(encrypted_columns(db_path, table)[col], passphrase) is None:
+        return None
+    with get_connection_manager(db_path).reader() as conn:
+        salt = blind_salt(conn)
+    if salt is None:
+        return None
+    key = blind_key(passphrase, salt, col)
+    digests = tuple(dict.fromkeys(blind_index(v, key) for v in values))
+    key[:] = bytes(len(key))
+    return ('blind', col, digests, table)
+
+def require_plain(db_path: str, table: str, columns: List[str]):
+    """Error si alguna columna está cifrada: filtrar o agregar obligaría a descifrar la tabla entera"""
+    encrypted = [c for c in dict.fromkeys(columns) if c in encrypted_columns(db_path, table)]
+    if encrypted:
+        raise ValueError(f"No se puede filtrar ni agregar sobre columnas cifradas: {', '.join(encrypted)}")
+
+def current_passphrase() -> str:
+    """Clave de la barra lateral o, si no hay, de la variable de entorno"""
+    return st.session_state.get('passphrase') or os.environ.get(ENCRYPTION_ENV, "")
+
+def column_session(entry: Dict, passphrase: str):
+    """KeySession de una columna cifrada, o None si falta la clave o no es la correcta
+
+    La clave derivada queda en la caché de ``db_crypto``: PBKDF2 solo se paga
+    la primera vez por (clave, columna).
+    """
+    if not passphrase or not crypto_available():
+        return None
+    from cryptography.exceptions import InvalidTag
+    from Database.db_crypto import KeySession
+    
+    session = KeySession(passphrase, entry['sal'])
+    try:
+        if session.decrypt(entry['verificador']) == ENCRYPTION_CHECK:
+            return session
+    except InvalidTag:
+        pass
+    return None
+
+class DecryptedValues:
+    """LRU de valores descifrados por (sal, blob); vive en la sesión, nunca se comparte"""
+
+    def __init__(self, max_entries: int = DECRYPT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._values: "OrderedDict[tuple, Optional[str]]" = OrderedDict()
+    
+    def decrypt(self, salt: bytes, blobs: pd.Series, session) -> List[Optional[str]]:
+        """Descifra solo los blobs que no están en la caché"""
+        from Database.db_crypto import decrypt_many
+        
+        missing = list(dict.fromkeys(b for b in blobs if isinstance(b, bytes) and (salt, b) not in self._values))
+        if missing:
+            for blob, value in zip(missing, decrypt_many(missing, session, encoding='utf-8')):
+                self._values[(salt, blob)] = value
+        out = []
+        for blob in blobs:
+            if not isinstance(blob, bytes):
+                out.append(None)
+                continue
+            self._values.move_to_end((salt, blob))
+            out.append(self._values[(salt, blob)])
+        while len(self._values) > self.max_entries:
+            self._values.popitem(last=False)
+        return out
+
+def decrypted_values() -> DecryptedValues:
+    """Caché de valores descifrados de la sesión actual"""
+    if 'descifrados' not in st.session_state:
+        st.session_state.descifrados = DecryptedValues()
+    return st.session_state.descifrados
+
+def decrypt_page(db_path: str, table: str, page_df: pd.DataFrame) -> pd.DataFrame:
+    """Descifra las columnas cifradas solo en las filas que se van a mostrar
+
+    Sin la clave correcta los valores se muestran como 🔒. Los valores
+    descifrados recuperan el tipo que tenía la columna antes de cifrarla.
+    """
+    mapping = encrypted_columns(db_path, table)
+    cols = [c for c in page_df.columns if c in mapping]
+    if not cols:
+        return page_df
+    start = time.perf_counter()
+    passphrase = current_passphrase()
+    page_df = page_df.copy()
+    for col in cols:
+        entry = mapping[col]
+        session = column_session(entry, passphrase)
+        if session is None:
+            page_df[col] = page_df[col].map(lambda b: "🔒" if isinstance(b, bytes) else None)
+            continue
+        values = pd.DataFrame({col: decrypted_values().decrypt(entry['sal'], page_df[col], session)},
+                              index=page_df.index)
+        page_df[col] = apply_types(values, {col: (entry['tipo'], entry['formato'])})[col]
+    get_profiler().record('decrypt', time.perf_counter() - start, table, f"{len(cols)} columnas cifradas",
+                          filas=len(page_df))
+    return page_df
+
+def encrypt_table_columns(db_path: str, table: str, columns: List[str], passphrase: str,
+                          blind: bool = False) -> int:
+    """Cifra columnas de la tabla en la propia BD (formato v2 de db_crypto, una sal por columna)
+
+    Guarda en ``_explorador_cifrado`` la sal, el tipo original y un verificador
+    de la clave. Con ``blind`` se escribe antes un índice ciego (HMAC) de cada
+    columna para poder filtrar por igualdad sin descifrar. Las estadísticas, el índice FTS5 y el uso registrado de esas
+    columnas se borran para no dejar valores en claro; con ``secure_delete``
+    las páginas liberadas se sobrescriben con ceros. Devuelve las filas cifradas.
+    """
+    from Database.db_crypto import KeySession, encrypt_column, new_salt
+    
+    catalog = type_catalog(db_path, table)
+    fts_cols = fts_columns(db_path, table)
+    remaining_fts = [c for c in fts_cols if c not in columns]
+    rows = 0
+    with get_connection_manager(db_path).writer() as conn:
+        conn.execute("PRAGMA secure_delete=ON")
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            ensure_meta_tables(conn)
+            for col in columns:
+                kind, fmt = catalog[col]
+                session = KeySession(passphrase, new_salt())
+                if blind:
+                    build_blind_index(conn, table, col, passphrase)
+                rows = encrypt_column(conn, table, col, session)
+                conn.execute(f"INSERT OR REPLACE INTO {META_PREFIX}cifrado VALUES (?, ?, ?, ?, ?, ?)",
+                             (table, col, session.salt, kind, fmt, session.encrypt(ENCRYPTION_CHECK)))
+                old = conn.execute(f"SELECT datos FROM {META_PREFIX}estadisticas WHERE tabla = ? AND columna = ?",
+                                   (table, col)).fetchone()
+                if old is not None:
+                    acc = ColumnStats('encrypted')
+                    acc.count, acc.nulls = json.loads(old[0])['count'], json.loads(old[0])['nulls']
+                    conn.execute(f"UPDATE {META_PREFIX}estadisticas SET datos = ? WHERE tabla = ? AND columna = ?",
+                                 (json.dumps(acc.result()), table, col))
+                # También los usos de otras columnas cuya consulta guardada filtra por esta
+                # (sus parámetros contienen valores en claro de la columna)
+                conn.execute(f"DELETE FROM {META_PREFIX}uso WHERE tabla = ? "
+                             f"AND (instr(columnas, ?) > 0 OR instr(consulta, ?) > 0)",
+                             (table, json.dumps(col), quote_ident(col)))
+            save_type_catalog(conn, table, {**catalog, **{col: ('encrypted', None) for col in columns}})
+            if len(remaining_fts) < len(fts_cols):
+                conn.execute(f"DROP TABLE IF EXISTS {quote_ident(fts_table(table))}")
+            conn.execute(f"INSERT INTO {META_PREFIX}versiones VALUES (?, 1) "
+                         f"ON CONFLICT(tabla) DO UPDATE SET version = version + 1", (table,))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.execute("PRAGMA secure_delete=OFF")
+        if remaining_fts and len(remaining_fts) < len(fts_cols):
+            build_fts_index(conn, table, fts_table(table), remaining_fts)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    
+    type_catalog.clear()
+    stats_catalog.clear()
+    get_query_cache().invalidate(db_path, table)
+    get_page_prefetcher().clear(db_path, table)
+    get_column_cache().purge(db_path, table)
+    # Exportaciones anteriores de la tabla (con los valores en claro)
+    if os.path.isdir(EXPORT_DIR):
+        for name in os.listdir(EXPORT_DIR):
+            if name.startswith(f"{table}_"):
+                os.remove(os.path.join(EXPORT_DIR, name))
+    return rows
+
+# ======================
+# Agregaciones en SQL
+# ======================
+
+AGG_SQL = {
+    'sum': "COALESCE(SUM({c}), 0)",
+    'mean': "AVG({c})",
+    'count': "COUNT({c})",
+    'min': "MIN({c})",
+    'max': "MAX({c})",
+}
+
+def group_candidates(db_path: str, table: str) -> List[str]:
+    """Columnas aptas para agrupar: texto o baja cardinalidad
+
+    Los valores distintos salen del catálogo de estadísticas: no se recorre la tabla.
+    """
+    kinds = column_kinds(db_path, table)
+    stats = stats_catalog(db_path, table)
+    return [c for c in table_columns(db_path, table) if kinds.get(c) != 'encrypted'
+            and (kinds.get(c) == 'text' or stats[c]['distinct'] < MAX_GROUPS)]
+
+def group_aggregate(db_path: str, table: str, filters: Tuple, group_col: str,
+                    agg_col: str, agg_func: str, engine: str = 'sqlite') -> pd.DataFrame:
+    """GROUP BY en el motor elegido sobre la tabla filtrada completa
+
+    El resultado queda memorizado por (tabla, filtros, grupo, agregado) en la
+    caché de ``run_query``, así que repetir el cálculo es instantáneo. Sin
+    ``typed``: un agregado no se compacta (p. ej. una suma no baja a int8).
+    """
+    sql, params, engine = group_aggregate_query(db_path, table, filters, group_col, agg_col, agg_func, engine)
+    get_index_advisor().observe(db_path, table, 'grupo', (group_col, agg_col), sql, params)
+    return run_query(db_path, sql, params, table=table, typed=False, engine=engine.name)
+
+def group_aggregate_query(db_path: str, table: str, filters: Tuple, group_col: str, agg_col: str,
+                          agg_func: str, engine: str = 'sqlite') -> Tuple[str, Tuple, QueryEngine]:
+    """SQL del GROUP BY en el dialecto del motor que lo va a ejecutar"""
+    require_plain(db_path, table, [group_col, agg_col] + [f[1] for f in filters if f[0] != 'blind'])
+    engine = query_engine(engine, db_path, table, filters)
+    g, c = quote_ident(group_col), quote_ident(agg_col)
+    out = quote_ident(f"{agg_func}_{agg_col}")
+    # Solo números: los valores que no encajaron en el tipo se guardaron tal cual
+    where, params = build_where(filters + (('notnull', group_col), ('numeric', agg_col)), engine)
+    sql = (f'SELECT {g}, {AGG_SQL[agg_func].format(c=c)} AS {out} FROM "{table}"{where} '
+           f'GROUP BY {g} ORDER BY {out} DESC, {g}')
+    return sql, params, engine
+
+# ======================
+# Histogramas
+# ======================
+
+def histogram(db_path: str, table: str, col: str, bins: int, filters: Tuple = (),
+              engine: str = 'sqlite') -> pd.DataFrame:
+    """Histograma calculado en el motor: solo viajan los bordes y los conteos
+
+    Tanto el rango como los conteos pasan por ``run_query``, así que quedan
+    cacheados por (columna, bins, filtros, motor) y versión de datos.
+    """
+    require_plain(db_path, table, [col] + [f[1] for f in filters if f[0] != 'blind'])
+    engine = query_engine(engine, db_path, table, filters)
+    c = quote_ident(col)
+    where, params = build_where(filters + (('numeric', col),), engine)
+    bounds = run_query(db_path, f'SELECT MIN({c}) AS lo, MAX({c}) AS hi FROM "{table}"{where}',
+                       params, table=table, typed=False, engine=engine.name)
+    lo, hi = bounds['lo'].iloc[0], bounds['hi'].iloc[0]
+    if pd.isna(lo):
+        return pd.DataFrame(columns=['desde', 'hasta', 'filas'])
+    lo, hi = float(lo), float(hi)
+    where, params = build_where(filters, engine)
+    sql, sql_params = histogram_query(table, col, lo, hi, bins, where, params, engine)
+    counts = run_query(db_path, sql, sql_params, table=table, typed=False, engine=engine.name)
+    width = (hi - lo) / bins if hi > lo else 1.0
+    filas = np.zeros(bins, dtype=np.int64)
+    filas[counts['bin'].astype(int).to_numpy()] = counts['n'].to_numpy()
+    edges = lo + width * np.arange(bins + 1)
+    return pd.DataFrame({'desde': edges[:-1], 'hasta': edges[1:], 'filas': filas})
+
+def histogram_chart(hist_df: pd.DataFrame, title: str, height: int = 500) -> alt.Chart:
+    """Barras a partir de bordes y conteos ya calculados"""
+    return alt.Chart(hist_df).mark_bar(color='#764ba2').encode(
+        x=alt.X('desde:Q', title=title), x2='hasta:Q', y='filas:Q',
+        tooltip=['desde', 'hasta', 'filas']
+    ).properties(height=height)
+
+def benchmark_engines(db_path: str, table: str, group_col: str, agg_col: str, hist_col: str,
+                      filters: Tuple = (), repeats: int = 3) -> pd.DataFrame:
+    """Tiempo (mejor de ``repeats``) de un GROUP BY y un histograma en cada motor, sin caché"""
+    c = quote_ident(hist_col)
+    where, params = build_where(filters + (('numeric', hist_col),))
+    lo, hi = run_query(db_path, f'SELECT MIN({c}), MAX({c}) FROM "{table}"{where}', params,
+                       table=table, typed=False).iloc[0]
+    rows, results = [], {}
+    for name, engine in ENGINES.items():
+        if not engine.available(db_path, table, filters):
+            continue
+        where, params = build_where(filters, engine)
+        queries = {
+            'GROUP BY': group_aggregate_query(db_path, table, filters, group_col, agg_col, 'mean', name)[:2],
+            'Histograma': histogram_query(table, hist_col, float(lo), float(hi), 30, where, params, engine),
+        }
+        for query, (sql, sql_params) in queries.items():
+            best = math.inf
+            for _ in range(repeats):
+                start = time.perf_counter()
+                out = engine.read(db_path, sql, sql_params, table)
+                best = min(best, time.perf_counter() - start)
+            reference = results.setdefault(query, out)
+            same = (reference.shape == out.shape and all(
+                np.allclose(reference[col], out[col]) if pd.api.types.is_numeric_dtype(out[col])
+                else (reference[col].astype(str) == out[col].astype(str)).all() for col in out.columns))
+            rows.append({'consulta': query, 'motor': engine.label, 'ms': best * 1000,
+                         'filas': len(out), 'iguales': same})
+    return pd.DataFrame(rows)
+
+# ======================
+# Dispersión
+# ======================
+
+def _grid_cells(x_col: str, y_col: str, bounds: Tuple[float, float, float, float],
+                grid: int) -> Tuple[str, str, Tuple]:
+    """Expresiones SQL de la celda (ix, iy) de cada punto en una rejilla grid x grid"""
+    x_lo, x_hi, y_lo, y_hi = bounds
+    wx = (x_hi - x_lo) / grid if x_hi > x_lo else 1.0
+    wy = (y_hi - y_lo) / grid if y_hi > y_lo else 1.0
+    ix = f"MIN(CAST(({quote_ident(x_col)} - ?) / ? AS INTEGER), {grid - 1})"
+    iy = f"MIN(CAST(({quote_ident(y_col)} - ?) / ? AS INTEGER), {grid - 1})"
+    return ix, iy, (x_lo, wx, y_lo, wy)
+
+def _scatter_filters(x_col: str, y_col: str, bounds: Tuple[float, float, float, float], filters: Tuple) -> Tuple:
+    x_lo, x_hi, y_lo, y_hi = bounds
+    return filters + (('numeric', x_col), ('numeric', y_col),
+                      ('range', x_col, x_lo, x_hi), ('range', y_col, y_lo, y_hi))
+
+def scatter_density(db_path: str, table: str, x_col: str, y_col: str, filters: Tuple,
+                    bounds: Tuple[float, float, float, float], grid: int = SCATTER_GRID) -> pd.DataFrame:
+    """Mapa de densidad: filas por celda de la rejilla, sobre la tabla completa"""
+    ix, iy, cell_params = _grid_cells(x_col, y_col, bounds, grid)
+    where, params = build_where(_scatter_filters(x_col, y_col, bounds, filters))
+    sql = f'SELECT {ix} AS ix, {iy} AS iy, COUNT(*) AS filas FROM "{table}"{where} GROUP BY ix, iy'
+    cells = run_query(db_path, sql, cell_params + params, table=table, typed=False)
+    x_lo, wx, y_lo, wy = cell_params
+    cells['x0'], cells['x1'] = x_lo + cells['ix'] * wx, x_lo + (cells['ix'] + 1) * wx
+    cells['y0'], cells['y1'] = y_lo + cells['iy'] * wy, y_lo + (cells['iy'] + 1) * wy
+    return cells
+
+def scatter_sample(db_path: str, table: str, x_col: str, y_col: str, color_col: Optional[str],
+                   filters: Tuple, bounds: Tuple[float, float, float, float], occupied_cells: int,
+                   cap: int = SCATTER_MAX_POINTS, seed: int = SCATTER_SEED) -> pd.DataFrame:
+    """Muestra estratificada por celda que conserva siempre los valores atípicos
+
+    Cada celda ocupada aporta como mucho cap/celdas puntos, elegidos con un hash
+    del rowid con semilla fija (misma muestra en cada ejecución); los puntos a
+    más de 3 desviaciones de la media (catálogo de estadísticas) entran primero.
+    """
+    stats = stats_catalog(db_path, table)
+    fences = []
+    for col in (x_col, y_col):
+        mean, std = stats[col]['mean'], stats[col]['std']
+        fences += [mean - 3 * std, mean + 3 * std] if std else [-1e308, 1e308]
+    
+    xc, yc = quote_ident(x_col), quote_ident(y_col)
+    cols = f"{xc}, {yc}" + (f", {quote_ident(color_col)}" if color_col else "")
+    ix, iy, cell_params = _grid_cells(x_col, y_col, bounds, SCATTER_GRID)
+    where, params = build_where(_scatter_filters(x_col, y_col, bounds, filters))
+    quota = max(1, math.ceil(cap / max(occupied_cells, 1)))
+    sql = f"""
+        WITH pts AS (
+            SELECT {cols}, {ix} * {SCATTER_GRID} + {iy} AS __celda,
+                   (rowid * 2654435761 + ?) % 4294967296 AS __h,
+                   ({xc} < ? OR {xc} > ? OR {yc} < ? OR {yc} > ?) AS __atipico
+            FROM "{table}"{where}
+        ), ranked AS (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY __celda ORDER BY __h) AS __rn FROM pts
+        )
+        SELECT {cols}, __atipico AS atipico FROM ranked
+        WHERE __rn <= ? OR __atipico
+        ORDER BY __atipico DESC, __rn, __h
+        LIMIT ?"""
+    sample = run_query(db_path, sql, cell_params + (seed,) + tuple(fences) + params + (quota, cap), table=table)
+    sample['atipico'] = sample['atipico'].astype(bool)
+    return sample
+
+# ======================
+# Series temporales y cajas
+# ======================
+
+# Inicio de cada periodo sobre fechas ISO-8601 guardadas como texto
+TIME_BUCKETS = {
+    'Día': "date({c})",
+    'Semana': "date({c}, 'weekday 0', '-6 days')",
+    'Mes': "strftime('%Y-%m-01', {c})",
+    'Trimestre': "printf('%s-%02d-01', strftime('%Y', {c}), ((CAST(strftime('%m', {c}) AS INTEGER) - 1) / 3) * 3 + 1)",
+}
+def time_series(db_path: str, table: str, date_col: str, bucket: str, value_col: Optional[str],
+                agg_func: str, filters: Tuple = ()) -> pd.DataFrame:
+    """Serie temporal agregada por periodo dentro de SQLite"""
+    c = quote_ident(date_col)
+    value = "COUNT(*)" if value_col is None else AGG_SQL[agg_func].format(c=quote_ident(value_col))
+    numeric = () if value_col is None else (('numeric', value_col),)
+    where, params = build_where(filters + (('notnull', date_col),) + numeric)
+    bucket_sql = TIME_BUCKETS[bucket].format(c=c)
+    sql = (f'SELECT {bucket_sql} AS periodo, {value} AS valor FROM "{table}"{where} '
+           f'GROUP BY periodo HAVING periodo IS NOT NULL ORDER BY periodo')
+    get_index_advisor().observe(db_path, table, 'orden', (date_col,), sql, params)
+    series = run_query(db_path, sql, params, table=table, typed=False)
+    series['periodo'] = pd.to_datetime(series['periodo'], format='%Y-%m-%d')
+    return series
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: índices de los puntos que conservan la forma de la serie"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    keep = [0]
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # Media del siguiente cubo (o el último punto)
+        nxt_end = edges[i + 2] if i + 2 < len(edges) else n
+        nxt_x, nxt_y = x[end:nxt_end].mean(), y[end:nxt_end].mean()
+        a = keep[-1]
+        area = np.abs((x[a] - nxt_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (nxt_y - y[a]))
+        keep.append(start + int(np.argmax(area)))
+    keep.append(n - 1)
+    return np.array(keep)
+
+def quantile_sketch(db_path: str, table: str, cat_col: str, value_col: str,
+                    filters: Tuple = (), max_categories: int = BOX_MAX_CATEGORIES) -> pd.DataFrame:
+    """Cuartiles y bigotes por categoría a partir de un sketch de histograma en SQLite
+
+    Para cada categoría se cuentan los valores en BOX_SKETCH_BINS barras de
+    anchura fija (un solo GROUP BY); los cuantiles se interpolan dentro de la
+    barra, con error menor que (máx - mín) / BOX_SKETCH_BINS. Mín, máx y n son exactos.
+    """
+    g, v = quote_ident(cat_col), quote_ident(value_col)
+    base = filters + (('notnull', cat_col), ('numeric', value_col))
+    where, params = build_where(base)
+    summary = run_query(db_path, f'SELECT {g} AS categoria, COUNT(*) AS n, MIN({v}) AS minimo, MAX({v}) AS maximo '
+                                 f'FROM "{table}"{where} GROUP BY {g} ORDER BY n DESC LIMIT ?',
+                        params + (max_categories,), table=table, typed=False)
+    if summary.empty:
+        return summary
+    
+    lo, hi = float(summary['minimo'].min()), float(summary['maximo'].max())
+    bins = BOX_SKETCH_BINS
+    width = (hi - lo) / bins if hi > lo else 1.0
+    where, params = build_where(base + (('in', cat_col, tuple(summary['categoria'])),))
+    sketch = run_query(db_path, f'SELECT {g} AS categoria, MIN(CAST(({v} - ?) / ? AS INTEGER), ?) AS bin, '
+                                f'COUNT(*) AS n FROM "{table}"{where} GROUP BY categoria, bin',
+                       (lo, width, bins - 1) + params, table=table, typed=False)
+    
+    rows = []
+    for cat, hist in sketch.groupby('categoria', sort=False):
+        counts = np.zeros(bins)
+        counts[hist['bin'].astype(int).to_numpy()] = hist['n'].to_numpy()
+        cum = np.cumsum(counts)
+        info = summary[summary['categoria'] == cat].iloc[0]
+        
+        def q(p: float) -> float:
+            target = p * cum[-1]
+            b = int(np.searchsorted(cum, target))
+            before = cum[b - 1] if b else 0.0
+            value = lo + (b + (target - before) / counts[b]) * width
+            return float(min(max(value, info['minimo']), info['maximo']))
+        
+        q1, median, q3 = q(0.25), q(0.5), q(0.75)
+        iqr = q3 - q1
+        rows.append({'categoria': cat, 'n': int(info['n']), 'minimo': info['minimo'], 'maximo': info['maximo'],
+                     'q1': q1, 'mediana': median, 'q3': q3,
+                     'bigote_inf': max(float(info['minimo']), q1 - 1.5 * iqr),
+                     'bigote_sup': min(float(info['maximo']), q3 + 1.5 * iqr)})
+    return pd.DataFrame(rows).sort_values('n', ascending=False)
+
+# ======================
+# Asesor de índices
+# ======================
+
+INDEX_PREFIX = f"{META_PREFIX}idx_"
+
+class IndexAdvisor:
+    """Registra qué columnas se filtran, agrupan y ordenan (en ``_explorador_uso``)
+
+    Cada consulta distinta cuenta una vez por proceso (se recuerdan las últimas
+    INDEX_SEEN_MAX); se guarda la última consulta de cada uso para medir la
+    latencia antes y después del índice. El uso se acumula en memoria y lo
+    escribe un hilo en segundo plano: una lectura nunca espera al escritor.
+    """
+
+    def __init__(self, max_seen: int = INDEX_SEEN_MAX):
+        self.max_seen = max_seen
+        self._seen: "OrderedDict[tuple, None]" = OrderedDict()
+        self._pending: Dict[str, List[tuple]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="asesor")
+        self._lock = threading.Lock()
+
+    def observe(self, db_path: str, table: str, usage: str, columns: Tuple[str, ...], sql: str, params: Tuple):
+        key = (db_path, table, usage, columns, sql, tuple(params))
+        with self._lock:
+            if key in self._seen:
+                self._seen.move_to_end(key)
+                return
+            self._seen[key] = None
+            while len(self._seen) > self.max_seen:
+                self._seen.popitem(last=False)
+            pending = self._pending.setdefault(db_path, [])
+            pending.append((table, json.dumps(list(columns)), usage, sql, dump_params(params)))
+            if len(pending) > 1:
+                return  # ya hay una escritura programada para esta BD
+        self._executor.submit(self._write, db_path)
+
+    def _write(self, db_path: str):
+        """Escribe de una vez el uso pendiente de una BD (en el hilo del asesor)"""
+        with self._lock:
+            rows = self._pending.pop(db_path, [])
+        if not rows:
+            return
+        try:
+            with get_connection_manager(db_path).writer() as conn:
+                conn.execute("BEGIN")
+                ensure_meta_tables(conn)
+                # Una consulta sobre una columna ya cifrada guardaría sus valores en claro
+                encrypted = conn.execute(f"SELECT tabla, columna FROM {META_PREFIX}cifrado").fetchall()
+                rows = [r for r in rows if not any(t == r[0] and quote_ident(c) in r[3] for t, c in encrypted)]
+                conn.executemany(f"INSERT INTO {META_PREFIX}uso VALUES (?, ?, ?, 1, ?, ?) "
+                                 f"ON CONFLICT(tabla, columnas, uso) DO UPDATE SET veces = veces + 1, "
+                                 f"consulta = excluded.consulta, parametros = excluded.parametros", rows)
+                conn.execute("COMMIT")
+        except sqlite3.Error:
+            pass  # BD de solo lectura u ocupada por otro proceso: el uso es orientativo
+
+def dump_params(params: Tuple) -> str:
+    """Parámetros de una consulta en JSON (los binarios, p. ej. de índices ciegos, en hexadecimal)"""
+    return json.dumps(list(params), default=lambda v: {'hex': v.hex()} if isinstance(v, bytes) else str(v))
+
+def load_params(text: str) -> Tuple:
+    """Inverso de ``dump_params``"""
+    return tuple(json.loads(text, object_hook=lambda d: bytes.fromhex(d['hex']) if set(d) == {'hex'} else d))
+
+@st.cache_resource
+def get_index_advisor() -> IndexAdvisor:
+    """Asesor de índices compartido por todas las sesiones"""
+    return IndexAdvisor()
+
+def observe_filters(db_path: str, table: str, filters: Tuple, sql: str, params: Tuple):
+    """Registra las columnas filtrables por índice: cada una y la combinación (igualdades + un rango)"""
+    equality = [f[1] for f in filters if f[0] == 'in' and f[2]]
+    ranges = [f[1] for f in filters if f[0] in ('range', 'date')]
+    advisor = get_index_advisor()
+    for col in dict.fromkeys(equality + ranges):
+        advisor.observe(db_path, table, 'filtro', (col,), sql, params)
+    combo = tuple(dict.fromkeys(equality + ranges[:1]))
+    if len(combo) > 1:
+        advisor.observe(db_path, table, 'filtro', combo, sql, params)
+
+def index_name(table: str, columns: Tuple[str, ...]) -> str:
+    digest = hashlib.sha1(json.dumps([table, list(columns)]).encode('utf-8')).hexdigest()[:8]
+    return f"{INDEX_PREFIX}{table}_{digest}"
+
+def existing_indexes(db_path: str, table: str) -> List[Tuple[str, Tuple[str, ...]]]:
+    """Índices de la tabla con sus columnas en orden"""
+    out = []
+    with get_connection_manager(db_path).reader() as conn:
+        for row in conn.execute(f"PRAGMA index_list({quote_ident(table)})").fetchall():
+            cols = conn.execute(f"PRAGMA index_info({quote_ident(row[1])})").fetchall()
+            out.append((row[1], tuple(c[2] for c in cols)))
+    return out
+
+def index_report(db_path: str, table: str) -> pd.DataFrame:
+    """Índices creados por el asesor con su latencia antes/después y tamaño en disco"""
+    with get_connection_manager(db_path).reader() as conn:
+        try:
+            return pd.read_sql_query(f"SELECT nombre, columnas, antes_ms, despues_ms, bytes, creado "
+                                     f"FROM {META_PREFIX}indices WHERE tabla = ? AND nombre IN "
+                                     f"(SELECT name FROM sqlite_master WHERE type = 'index') ORDER BY creado", conn,
+                                     params=(table,))
+        except pd.errors.DatabaseError:
+            return pd.DataFrame(columns=['nombre', 'columnas', 'antes_ms', 'despues_ms', 'bytes', 'creado'])
+
+def index_proposals(db_path: str, table: str) -> pd.DataFrame:
+    """Índices sugeridos a partir del uso registrado, del más usado al menos
+
+    Se descartan los ya cubiertos por un índice existente (mismo prefijo de
+    columnas) y los de filtro sobre columnas con menos de INDEX_MIN_DISTINCT
+    valores. El tamaño es una estimación por filas y anchura media de columna.
+    """
+    with get_connection_manager(db_path).reader() as conn:
+        try:
+            usage = pd.read_sql_query(f"SELECT columnas, uso, veces, consulta, parametros FROM {META_PREFIX}uso "
+                                      f"WHERE tabla = ? AND veces >= ? ORDER BY veces DESC", conn,
+                                      params=(table, INDEX_MIN_USES))
+        except pd.errors.DatabaseError:
+            return pd.DataFrame()
+    covered = [cols for _, cols in existing_indexes(db_path, table)]
+    stats = stats_catalog(db_path, table)
+    rows = count_rows(db_path, table)
+    proposals = {}
+    for item in usage.itertuples(index=False):
+        columns = tuple(json.loads(item.columnas))
+        if any(col not in stats for col in columns):
+            continue
+        if any(cols[:len(columns)] == columns for cols in covered):
+            continue
+        if item.uso == 'filtro' and len(columns) == 1 and stats[columns[0]]['distinct'] < INDEX_MIN_DISTINCT:
+            continue
+        if columns in proposals:
+            proposals[columns]['veces'] += item.veces
+            continue
+        proposals[columns] = {
+            'columnas': columns, 'uso': item.uso, 'veces': item.veces,
+            'tipo': 'compuesto' if len(columns) > 1 else 'simple',
+            'bytes_est': int(rows * (sum(column_width(db_path, table, c) for c in columns) + 12) * 1.3),
+            'consulta': item.consulta, 'parametros': load_params(item.parametros),
+        }
+    return pd.DataFrame(list(proposals.values()))
+
+def column_width(db_path: str, table: str, col: str) -> float:
+    """Bytes medios de una columna (cacheado por versión)"""
+    c = quote_ident(col)
+    df = run_query(db_path, f'SELECT AVG(LENGTH(CAST({c} AS BLOB))) AS w FROM "{table}"', table=table, typed=False)
+    return float(df['w'].iloc[0] or 0)
+
+def time_query(db_path: str, sql: str, params: Tuple, repeats: int = 3) -> float:
+    """Mejor tiempo (ms) de una consulta, sin pasar por la caché"""
+    best = math.inf
+    with get_connection_manager(db_path).reader() as conn:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _advisor_bytes(db_path: str, version: tuple) -> int:
+    """Disco ocupado por los índices del asesor para una versión (``version`` solo forma parte de la clave)"""
+    with get_connection_manager(db_path).reader() as conn:
+        try:
+            return int(conn.execute("SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE substr(name, 1, ?) = ?",
+                                    (len(INDEX_PREFIX), INDEX_PREFIX)).fetchone()[0])
+        except sqlite3.OperationalError:
+            return 0  # SQLite sin dbstat
+
+def advisor_bytes(db_path: str) -> int:
+    """Disco ocupado por los índices del asesor (dbstat), renovado al cambiar la versión de la BD"""
+    return _advisor_bytes(db_path, data_version(db_path))
+
+def create_index(db_path: str, table: str, columns: Tuple[str, ...], sql: str, params: Tuple,
+                 timeout: Optional[float] = None) -> Dict:
+    """Crea el índice, mide la consulta de referencia antes y después y lo anota en ``_explorador_indices``"""
+    name = index_name(table, columns)
+    before = time_query(db_path, sql, params)
+    with get_connection_manager(db_path).writer(timeout=timeout) as conn:
+        cols_sql = ", ".join(quote_ident(c) for c in columns)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {quote_ident(name)} ON {quote_ident(table)} ({cols_sql})")
+        conn.execute(f"ANALYZE {quote_ident(name)}")
+    after = time_query(db_path, sql, params)
+    with get_connection_manager(db_path).reader() as conn:
+        try:
+            size = conn.execute("SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name = ?", (name,)).fetchone()[0]
+        except sqlite3.OperationalError:
+            size = None
+    entry = {'nombre': name, 'columnas': json.dumps(list(columns), ensure_ascii=False), 'antes_ms': before,
+             'despues_ms': after, 'bytes': size, 'creado': datetime.now().isoformat(timespec='seconds')}
+    with get_connection_manager(db_path).writer(timeout=timeout) as conn:
+        ensure_meta_tables(conn)
+        conn.execute(f"INSERT OR REPLACE INTO {META_PREFIX}indices VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     (name, table, entry['columnas'], before, after, size, entry['creado']))
+    return entry
+
+def advisor_index_sql(conn: sqlite3.Connection, table: str) -> List[str]:
+    """CREATE INDEX de los índices del asesor sobre la tabla (para recrearlos tras reimportar)"""
+    return [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND substr(name, 1, ?) = ?",
+        (table, len(INDEX_PREFIX), INDEX_PREFIX))]
+
+# ======================
+# Importación de CSV
+# ======================
+
+SQL_TYPES = {'integer': 'INTEGER', 'real': 'REAL', 'datetime': 'TIMESTAMP', 'date': 'DATE', 'text': 'TEXT'}
+
+def sniff_encoding(csv_file, sample_size: int = 1 << 16) -> str:
+    """Detecta la codificación leyendo solo el principio del archivo"""
+    head = csv_file.read(sample_size)
+    csv_file.seek(0)
+    if head.startswith(b'\xef\xbb\xbf'):
+        return 'utf-8-sig'
+    try:
+        # Decodificador incremental: un carácter cortado al final no es un error
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+def infer_schema(chunk: pd.DataFrame) -> Dict[str, Tuple[str, Optional[str]]]:
+    """Tipo (y formato de fecha) de cada columna a partir de un lote de datos"""
+    schema = {}
+    for col in chunk.columns:
+        s = chunk[col].dropna()
+        if pd.api.types.is_bool_dtype(s) or pd.api.types.is_integer_dtype(s):
+            schema[col] = ('integer', None)
+        elif pd.api.types.is_float_dtype(s):
+            schema[col] = ('integer' if len(s) and (s == s.round()).all() else 'real', None)
+        elif pd.api.types.is_datetime64_any_dtype(s):
+            schema[col] = ('datetime', None)
+        else:
+            fmt = detect_date_format(s) if len(s) else None
+            if fmt is None:
+                schema[col] = ('text', None)
+                continue
+            parsed = pd.to_datetime(s, format=fmt)
+            kind = 'date' if (parsed == parsed.dt.normalize()).all() else 'datetime'
+            if fmt == 'ISO8601' and pd.to_datetime(s, format=STORAGE_FORMATS[kind], errors='coerce').notna().all():
+                fmt = STORAGE_FORMATS[kind]
+            schema[col] = (kind, fmt)
+    return schema
+
+def convert_chunk(chunk: pd.DataFrame, schema: Dict[str, Tuple[str, Optional[str]]]) -> pd.DataFrame:
+    """Convierte un lote al esquema (fechas en ISO-8601)
+
+    Los valores que no encajan en el tipo inferido se guardan tal cual (SQLite
+    admite tipos mixtos), así nunca se pierde información.
+    """
+    out = {}
+    for col, (kind, fmt) in schema.items():
+        s = chunk[col]
+        if kind in ('integer', 'real'):
+            conv = pd.to_numeric(s, errors='coerce')
+            if kind == 'integer' and (conv.dropna() == conv.dropna().round()).all():
+                conv = conv.astype('Int64')
+        elif kind in ('date', 'datetime'):
+            parsed = pd.to_datetime(s, format=fmt, errors='coerce')
+            conv = parsed.dt.strftime(STORAGE_FORMATS[kind])
+        else:
+            out[col] = s.astype(object)
+            continue
+        conv = conv.astype(object)
+        bad = conv.isna() & s.notna()
+        out[col] = conv.where(~bad, s.astype(object)) if bad.any() else conv
+    return pd.DataFrame(out, index=chunk.index)
+
+def import_csv_to_db(csv_file, db_path: str, table_name: str,
+                     progress: Optional[Callable[[int, int, int, float], None]] = None,
+                     encoding: Optional[str] = None, fts_columns: Optional[List[str]] = None) -> int:
+    """Importa un CSV a SQLite por lotes, sin cargarlo entero en memoria
+
+    Se construye en una tabla sombra y al final se sustituye la tabla destino
+    en una sola transacción. ``progress(bytes_leidos, bytes_totales, filas, segundos)``
+    se llama tras cada lote. Solo se crea índice FTS5 para las columnas de texto
+    de ``fts_columns`` (opcional: una pasada más y disco extra). Devuelve el número
+    de filas importadas.
+    """
+    csv_file.seek(0, io.SEEK_END)
+    total_bytes = csv_file.tell()
+    csv_file.seek(0)
+    encoding = encoding or sniff_encoding(csv_file)
+    retry_latin1 = False
+    
+    shadow = f"{META_PREFIX}import_{table_name}"
+    with get_connection_manager(db_path).writer() as conn:
+        # Ajustes de carga masiva solo mientras dura la importación
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-200000")
+        
+        start = time.perf_counter()
+        rows = 0
+        parse_s = 0.0
+        try:
+            conn.execute(f"DROP TABLE IF EXISTS {quote_ident(shadow)}")
+            schema = None
+            insert_sql = None
+            accumulators = {}
+            for chunk in pd.read_csv(csv_file, encoding=encoding, chunksize=IMPORT_CHUNK_ROWS):
+                parse_start = time.perf_counter()
+                if schema is None:
+                    schema = infer_schema(chunk)
+                    cols_sql = ", ".join(f"{quote_ident(c)} {SQL_TYPES[k]}" for c, (k, _) in schema.items())
+                    # rowid explícito: los índices FTS5 y ciegos apuntan a él y VACUUM no lo cambia
+                    conn.execute(f"CREATE TABLE {quote_ident(shadow)} "
+                                 f"({quote_ident(ROW_ID_COL)} INTEGER PRIMARY KEY, {cols_sql})")
+                    insert_sql = (f"INSERT INTO {quote_ident(shadow)} ({', '.join(map(quote_ident, schema))}) "
+                                  f"VALUES ({', '.join('?' * len(schema))})")
+                    accumulators = {col: ColumnStats(kind) for col, (kind, _) in schema.items()}
+                frame = convert_chunk(chunk, schema)
+                parse_s += time.perf_counter() - parse_start
+                for col, acc in accumulators.items():
+                    acc.update(frame[col])
+                conn.execute("BEGIN")
+                conn.executemany(insert_sql, frame.where(frame.notna(), None).itertuples(index=False, name=None))
+                conn.execute("COMMIT")
+                rows += len(chunk)
+                if progress:
+                    progress(min(csv_file.tell(), total_bytes), total_bytes, rows, time.perf_counter() - start)
+            
+            stats = finish_stats(conn, shadow, accumulators)
+            
+            # Índice de texto completo solo para las columnas de texto elegidas
+            shadow_fts = fts_table(shadow)
+            text_cols = [col for col, (kind, _) in schema.items() if kind == 'text' and col in (fts_columns or ())]
+            has_fts = bool(text_cols) and build_fts_index(conn, shadow, shadow_fts, text_cols)
+            
+            # Sustitución atómica de la tabla destino
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute("BEGIN IMMEDIATE")
+            index_sql = advisor_index_sql(conn, table_name)
+            conn.execute(f"DROP TABLE IF EXISTS {quote_ident(table_name)}")
+            conn.execute(f"ALTER TABLE {quote_ident(shadow)} RENAME TO {quote_ident(table_name)}")
+            # Los índices del asesor se recrean si sus columnas siguen existiendo
+            for sql in index_sql:
+                try:
+                    conn.execute(sql)
+                except sqlite3.OperationalError:
+                    pass
+            conn.execute(f"DROP TABLE IF EXISTS {quote_ident(fts_table(table_name))}")
+            if has_fts:
+                conn.execute(f"ALTER TABLE {quote_ident(shadow_fts)} RENAME TO {quote_ident(fts_table(table_name))}")
+            ensure_meta_tables(conn)
+            save_type_catalog(conn, table_name, {col: (kind, STORAGE_FORMATS.get(kind))
+                                                 for col, (kind, _) in schema.items()})
+            save_stats_catalog(conn, table_name, stats)
+            conn.execute(f"DELETE FROM {META_PREFIX}cifrado WHERE tabla = ?", (table_name,))
+            conn.execute(f"DROP TABLE IF EXISTS {quote_ident(blind_table(table_name))}")
+            conn.execute(f"INSERT INTO {META_PREFIX}versiones VALUES (?, 1) "
+                         f"ON CONFLICT(tabla) DO UPDATE SET version = version + 1", (table_name,))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            conn.execute(f"DROP TABLE IF EXISTS {quote_ident(shadow)}")
+            conn.execute(f"DROP TABLE IF EXISTS {quote_ident(fts_table(shadow))}")
+            # La muestra parecía UTF-8 pero un lote posterior no lo es: se repite en latin-1
+            if not isinstance(e, UnicodeDecodeError) or encoding == 'latin-1':
+                raise
+            retry_latin1 = True
+        finally:
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=DEFAULT")
+            conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    
+    if retry_latin1:
+        csv_file.seek(0)
+        return import_csv_to_db(csv_file, db_path, table_name, progress, encoding='latin-1',
+                                fts_columns=fts_columns)
+    
+    type_catalog.clear()
+    stats_catalog.clear()
+    get_query_cache().invalidate(db_path, table_name)
+    get_page_prefetcher().clear(db_path, table_name)
+    get_column_cache().clear(db_path, table_name)
+    get_profiler().record('import', time.perf_counter() - start, table_name, f"CSV ({encoding})",
+                          filas=rows, bytes=total_bytes, tipos_s=parse_s)
+    return rows
+
+# ======================
+# Exportación
+# ======================
+
+EXPORT_FORMATS = {
+    'csv': ('csv', "text/csv"),
+    'excel': ('xlsx', "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    'parquet': ('parquet', "application/octet-stream"),
+}
+EXCEL_MAX_ROWS = 1_048_575  # filas de datos por hoja (más la cabecera)
+
+def export_fingerprint(db_path: str, table: str, filters: Tuple, fmt: str) -> str:
+    """Huella de una exportación: tabla + versión de datos + filtros + formato"""
+    key = repr((os.path.abspath(db_path), table, data_version(db_path, table), filters, fmt))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+def export_path(db_path: str, table: str, filters: Tuple, fmt: str) -> str:
+    ext = EXPORT_FORMATS[fmt][0]
+    return os.path.join(EXPORT_DIR, f"{table}_{export_fingerprint(db_path, table, filters, fmt)}.{ext}")
+
+def iter_table_chunks(db_path: str, table: str, filters: Tuple, typed: bool = True):
+    """Recorre la tabla (filtrada) por lotes sin cargarla entera"""
+    where, params = build_where(filters)
+    catalog = type_catalog(db_path, table) if typed else {}
+    cols_sql = ", ".join(f'"{table}".{quote_ident(c)}' for c in table_columns(db_path, table))
+    with get_connection_manager(db_path).reader() as conn:
+        for chunk in pd.read_sql_query(f'SELECT {cols_sql} FROM "{table}"{where}', conn,
+                                       params=params, chunksize=EXPORT_CHUNK_ROWS):
+            yield apply_types(chunk, catalog) if typed else chunk
+
+def blobs_as_hex(chunk: pd.DataFrame) -> pd.DataFrame:
+    """Valores binarios (columnas cifradas) en hexadecimal: CSV y Excel solo guardan texto"""
+    for col in chunk.columns:
+        if chunk[col].dtype == object and chunk[col].map(lambda v: isinstance(v, bytes)).any():
+            chunk[col] = chunk[col].map(lambda v: v.hex() if isinstance(v, bytes) else v)
+    return chunk
+
+def _write_csv(chunks, path: str):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for i, chunk in enumerate(chunks):
+            blobs_as_hex(chunk).to_csv(f, header=(i == 0), index=False)
+
+def _write_excel(chunks, path: str, columns: List[str]):
+    import xlsxwriter
+    
+    # constant_memory: cada fila se vuelca a disco en cuanto se completa
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'nan_inf_to_errors': True})
+    date_fmt = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+    sheet, row = None, EXCEL_MAX_ROWS
+    try:
+        for chunk in chunks:
+            chunk = blobs_as_hex(chunk)
+            dates = [pd.api.types.is_datetime64_any_dtype(chunk[c]) for c in chunk.columns]
+            for values in chunk.astype(object).itertuples(index=False, name=None):
+                if row >= EXCEL_MAX_ROWS:
+                    n = len(workbook.worksheets()) + 1
+                    sheet = workbook.add_worksheet('Datos' if n == 1 else f'Datos_{n}')
+                    sheet.write_row(0, 0, columns)
+                    row = 0
+                row += 1
+                for j, value in enumerate(values):
+                    if value is None or value is pd.NaT or (isinstance(value, float) and value != value):
+                        continue
+                    if dates[j]:
+                        sheet.write_datetime(row, j, value.to_pydatetime(), date_fmt)
+                    else:
+                        sheet.write(row, j, value)
+        if sheet is None:
+            workbook.add_worksheet('Datos').write_row(0, 0, columns)
+    finally:
+        workbook.close()
+
+def _write_parquet(chunks, path: str, catalog: Dict[str, Tuple[str, Optional[str]]]):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    schema = arrow_schema(catalog)
+    # Un row group por lote: nunca se materializa la tabla completa
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+def _prune_exports():
+    """Conserva solo las EXPORT_MAX_FILES exportaciones más recientes"""
+    files = sorted((os.path.join(EXPORT_DIR, f) for f in os.listdir(EXPORT_DIR)), key=os.path.getmtime)
+    for path in files[:-EXPORT_MAX_FILES]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def export_table(db_path: str, table: str, filters: Tuple, fmt: str) -> str:
+    """Genera (o reutiliza de disco) la exportación completa y devuelve su ruta"""
+    path = export_path(db_path, table, filters, fmt)
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+    
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    tmp_path = path + ".part"
+    try:
+        if fmt == 'csv':
+            # Valores tal cual están en SQLite: no hace falta convertir tipos
+            _write_csv(iter_table_chunks(db_path, table, filters, typed=False), tmp_path)
+        elif fmt == 'excel':
+            _write_excel(iter_table_chunks(db_path, table, filters), tmp_path, table_columns(db_path, table))
+        elif fmt == 'parquet':
+            _write_parquet(iter_table_chunks(db_path, table, filters), tmp_path,
+                           arrow_catalog(db_path, table, type_catalog(db_path, table)))
+        else:
+            raise ValueError(f"Formato desconocido: {fmt}")
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _prune_exports()
+    return path
 
 # ======================
 # Header
@@ -220,17 +2669,33 @@ with st.sidebar:
         
         if uploaded_file:
             table_name = st.text_input("Nombre de la tabla", value="datos_importados")
+            # Solo la cabecera: las columnas para el índice de búsqueda opcional
+            try:
+                header = list(pd.read_csv(uploaded_file, nrows=0, encoding=sniff_encoding(uploaded_file)).columns)
+            except ValueError:
+                header = []  # el error se mostrará al importar
+            uploaded_file.seek(0)
+            fts_choice = st.multiselect(
+                "Búsqueda rápida de texto (FTS5) en:", header,
+                help="Índice de palabras para las columnas de texto elegidas; alarga la importación y ocupa disco"
+            )
             
             if st.button("🚀 Importar CSV", use_container_width=True):
-                with st.spinner("Importando datos..."):
-                    try:
-                        df = import_csv_to_db(uploaded_file, db_path, table_name)
-                        st.session_state.current_table = table_name
-                        list_tables.clear()
-                        st.success(f"✅ {len(df)} filas importadas correctamente")
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"❌ Error: {str(e)}")
+                bar = st.progress(0.0, text="Importando datos...")
+                
+                def show_progress(done: int, total: int, rows: int, elapsed: float):
+                    speed = done / max(elapsed, 1e-6) / 1e6
+                    bar.progress(done / max(total, 1),
+                                 text=f"📥 {rows:,} filas • {speed:.1f} MB/s • {rows / max(elapsed, 1e-6):,.0f} filas/s")
+                
+                try:
+                    rows = import_csv_to_db(uploaded_file, db_path, table_name, progress=show_progress,
+                                            fts_columns=fts_choice)
+                    st.session_state.current_table = table_name
+                    st.success(f"✅ {rows:,} filas importadas correctamente")
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"❌ Error: {str(e)}")
     
     with tab2:
         st.markdown("**Conectar a BD SQLite**")
@@ -245,14 +2710,74 @@ with st.sidebar:
     
     st.markdown("---")
     
-    # Lista de tablas disponibles
-    tables = list_tables(db_path)
-    if tables:
+    # Lista de tablas disponibles (desde el catálogo: no lee datos)
+    db_catalog = table_catalog(db_path)
+    if db_catalog:
         st.markdown("### 📋 Tablas Disponibles")
-        selected = st.radio("Selecciona una tabla:", tables, index=0)
+        
+        def table_label(name: str) -> str:
+            entry = db_catalog[name]
+            size = f" • {entry['bytes_datos'] / 1e6:,.1f} MB" if entry['bytes_datos'] is not None else ""
+            return f"{name} ({entry['filas']:,} filas{size})"
+        
+        selected = st.radio("Selecciona una tabla:", list(db_catalog), index=0, format_func=table_label)
         if selected != st.session_state.current_table:
             st.session_state.current_table = selected
             st.rerun()
+        
+        with st.expander("🗂️ Esquema"):
+            entry = db_catalog[selected]
+            if entry['bytes_indices'] is not None:
+                st.caption(f"Datos: {entry['bytes_datos'] / 1e6:,.1f} MB • "
+                           f"índices: {entry['bytes_indices'] / 1e6:,.1f} MB")
+            st.dataframe(pd.DataFrame(entry['columnas']), use_container_width=True, hide_index=True)
+            for index in entry['indices']:
+                st.caption(f"{'🔑' if index['unico'] else '📇'} {index['nombre']}: {', '.join(index['columnas'])}")
+        
+        with st.expander("🔒 Columnas cifradas"):
+            if not crypto_available():
+                st.caption("Requiere el paquete cryptography")
+            else:
+                st.text_input("Clave:", type="password", key="passphrase",
+                              help=f"También se puede dar en la variable de entorno {ENCRYPTION_ENV}")
+                encrypted = db_catalog[selected]['cifradas']
+                if encrypted:
+                    unlocked = all(column_session(e, current_passphrase()) for e in encrypted.values())
+                    st.caption(f"🔒 {', '.join(encrypted)} • "
+                               + ("🔓 clave correcta" if unlocked else "hace falta la clave para ver los valores"))
+                    if db_catalog[selected]['ciegas']:
+                        st.caption(f"🔎 Índice ciego (igualdad): {', '.join(db_catalog[selected]['ciegas'])}")
+                plain = [c['nombre'] for c in db_catalog[selected]['columnas'] if c['nombre'] not in encrypted]
+                to_encrypt = st.multiselect("Cifrar columnas:", plain, key="encrypt_cols")
+                with_blind = st.checkbox("Con índice ciego (filtrar por igualdad sin descifrar)", key="encrypt_blind")
+                if st.button("🔒 Cifrar", disabled=not (to_encrypt and current_passphrase()),
+                             use_container_width=True):
+                    with st.spinner("Cifrando columnas..."):
+                        rows = encrypt_table_columns(db_path, selected, to_encrypt, current_passphrase(),
+                                                     blind=with_blind)
+                    st.success(f"✅ {len(to_encrypt)} columnas cifradas ({rows:,} filas)")
+                    st.rerun()
+    
+    with st.expander("🔌 Conexiones"):
+        pool = get_connection_manager(db_path).metrics()
+        st.caption(f"Lectores: {pool['readers_busy']} ocupados / {pool['readers_open']} abiertos "
+                   f"(máx. {SQLITE_MAX_READERS}) • esperas: {pool['waits']} ({pool['wait_s']:.2f} s)")
+        st.caption(f"Escrituras: {pool['writes']} • espera escritor: {pool['writer_wait_s']:.2f} s "
+                   f"• {'🔒 escribiendo' if pool['writer_busy'] else '✅ libre'}")
+        st.number_input("Tiempo máximo por consulta (s):", min_value=1, max_value=600,
+                        value=QUERY_TIMEOUT_S, key="query_timeout")
+    
+    with st.expander("🧠 Caché de consultas"):
+        qc = get_query_cache().stats()
+        st.caption(f"Aciertos: {qc['hits']:,} • fallos: {qc['misses']:,} ({qc['hit_rate']:.0%} de aciertos)")
+        st.caption(f"{qc['entries']:,} resultados • {qc['bytes'] / 1e6:,.1f} / {QUERY_CACHE_MAX_MB} MB "
+                   f"• expulsados: {qc['evictions']:,} • invalidados: {qc['invalidations']:,}")
+        memory = get_query_cache().memory_report()
+        if not memory.empty:
+            st.caption(f"Compactación (category y tipos reducidos): {memory['sin_compactar'].sum() / 1e6:,.1f} → "
+                       f"{memory['bytes'].sum() / 1e6:,.1f} MB")
+            st.dataframe(memory.style.format({'bytes': '{:,}', 'sin_compactar': '{:,}', 'ahorro': '{:.0%}'}),
+                         use_container_width=True, hide_index=True)
 
 # ======================
 # Contenido Principal
@@ -262,7 +2787,10 @@ if st.session_state.current_table:
     table = st.session_state.current_table
     
     # Cargar datos
-    df = run_query(db_path, f'SELECT * FROM "{table}" LIMIT 10000')
+    total_rows = count_rows(db_path, table)
+    table_cols = table_columns(db_path, table)
+    kinds = column_kinds(db_path, table)
+    table_stats = stats_catalog(db_path, table)
     
     # Métricas principales
     col1, col2, col3, col4 = st.columns(4)
@@ -270,7 +2798,7 @@ if st.session_state.current_table:
     with col1:
         st.markdown(f"""
         <div class="metric-card">
-            <h3>{len(df):,}</h3>
+            <h3>{total_rows:,}</h3>
             <p>Filas</p>
         </div>
         """, unsafe_allow_html=True)
@@ -278,13 +2806,13 @@ if st.session_state.current_table:
     with col2:
         st.markdown(f"""
         <div class="metric-card">
-            <h3>{len(df.columns)}</h3>
+            <h3>{len(table_cols)}</h3>
             <p>Columnas</p>
         </div>
         """, unsafe_allow_html=True)
     
     with col3:
-        numeric_cols = df.select_dtypes(include=['number']).columns
+        numeric_cols = [c for c in table_cols if kinds.get(c) == 'numeric']
         st.markdown(f"""
         <div class="metric-card">
             <h3>{len(numeric_cols)}</h3>
@@ -293,7 +2821,7 @@ if st.session_state.current_table:
         """, unsafe_allow_html=True)
     
     with col4:
-        missing = df.isnull().sum().sum()
+        missing = sum(table_stats[c]['nulls'] for c in table_cols)
         st.markdown(f"""
         <div class="metric-card">
             <h3>{missing:,}</h3>
@@ -311,24 +2839,19 @@ if st.session_state.current_table:
         st.markdown("### 📋 Vista General de los Datos")
         
         # Selector de columnas
-        all_cols = df.columns.tolist()
+        all_cols = table_cols
         selected_cols = st.multiselect(
             "Selecciona columnas a mostrar:",
             options=all_cols,
             default=all_cols[:10] if len(all_cols) > 10 else all_cols
         )
         
-        if selected_cols:
-            display_df = df[selected_cols]
-        else:
-            display_df = df
-        
-        # Paginación
+        # Paginación (solo se lee de SQLite la página visible)
         col1, col2, col3 = st.columns([2, 2, 1])
         with col1:
             rows_per_page = st.selectbox("Filas por página:", [25, 50, 100, 250], index=1)
         with col2:
-            total_pages = max(1, (len(display_df) - 1) // rows_per_page + 1)
+            total_pages = max(1, (total_rows - 1) // rows_per_page + 1)
             page = st.number_input("Página:", min_value=1, max_value=total_pages, value=1)
         with col3:
             st.metric("Total páginas", total_pages)
@@ -337,20 +2860,41 @@ if st.session_state.current_table:
         end_idx = start_idx + rows_per_page
         
         # Mostrar información de registros
-        st.info(f"📊 Mostrando registros {start_idx + 1} a {min(end_idx, len(display_df))} de {len(display_df)}")
+        st.info(f"📊 Mostrando registros {start_idx + 1:,} a {min(end_idx, total_rows):,} de {total_rows:,}")
         
         # DataFrame con mejor formato
         st.dataframe(
-            display_df.iloc[start_idx:end_idx],
+            decrypt_page(db_path, table, fetch_page(db_path, table, selected_cols, page, rows_per_page)),
             use_container_width=True,
             height=400
         )
+        if get_column_cache().ready(db_path, table, data_version(db_path, table)):
+            st.caption("⚡ Página leída de la copia columnar (Arrow, memory-map)")
         
         # Estadísticas rápidas
         with st.expander("📊 Estadísticas Descriptivas"):
-            st.markdown("**Resumen estadístico de todas las columnas:**")
-            stats_df = display_df.describe(include='all').transpose()
+            st.markdown("**Resumen estadístico de la tabla completa:**")
+            stats_cols = selected_cols or table_cols
+            stats_df = pd.DataFrame([{
+                'columna': c,
+                'tipo': table_stats[c]['tipo'],
+                'valores': table_stats[c]['count'],
+                'nulos': table_stats[c]['nulls'],
+                'distintos (aprox.)': table_stats[c]['distinct'],
+                'mín': table_stats[c]['min'],
+                'máx': table_stats[c]['max'],
+                'media': table_stats[c]['mean'],
+                'desv. típica': table_stats[c]['std'],
+                'más frecuentes': ", ".join(f"{v} ({n:,})" for v, n in table_stats[c]['top']),
+            } for c in stats_cols]).set_index('columna').astype({'mín': str, 'máx': str})
             st.dataframe(stats_df, use_container_width=True, height=400)
+            
+            hist_cols = [c for c in stats_cols if table_stats[c]['hist']]
+            if hist_cols:
+                hist_col = st.selectbox("Distribución de:", hist_cols)
+                hist = table_stats[hist_col]['hist']
+                hist_df = pd.DataFrame({'desde': hist['edges'][:-1], 'hasta': hist['edges'][1:], 'filas': hist['counts']})
+                st.altair_chart(histogram_chart(hist_df, hist_col, height=250), use_container_width=True)
     
     # TAB 2: Filtros
     with tab2:
@@ -359,54 +2903,94 @@ if st.session_state.current_table:
         col1, col2 = st.columns(2)
         
         with col1:
-            filter_col = st.selectbox("Columna a filtrar:", ["--Selecciona--"] + df.columns.tolist())
+            filter_cols = st.multiselect("Columnas a filtrar:", table_cols)
         
-        filtered_df = df.copy()
+        filters = []
+        search_cols = fts_columns(db_path, table)
         
-        if filter_col != "--Selecciona--":
+        if filter_cols:
             with col2:
-                col_data = df[filter_col]
-                
-                # Filtro según tipo de dato
-                if pd.api.types.is_numeric_dtype(col_data):
-                    min_val = float(col_data.min())
-                    max_val = float(col_data.max())
-                    range_vals = st.slider(
-                        "Rango de valores:",
-                        min_val, max_val, (min_val, max_val)
-                    )
-                    filtered_df = df[(df[filter_col] >= range_vals[0]) & (df[filter_col] <= range_vals[1])]
-                
-                elif pd.api.types.is_datetime64_any_dtype(col_data):
-                    date_range = st.date_input(
-                        "Rango de fechas:",
-                        value=(col_data.min(), col_data.max())
-                    )
-                    if len(date_range) == 2:
-                        filtered_df = df[(df[filter_col] >= pd.Timestamp(date_range[0])) & 
-                                        (df[filter_col] <= pd.Timestamp(date_range[1]))]
-                    else:
-                        filtered_df = df
-                
-                else:
-                    unique_vals = col_data.dropna().unique()
-                    if len(unique_vals) <= 20:
-                        selected_vals = st.multiselect(
-                            "Selecciona valores:",
-                            options=unique_vals.tolist(),
-                            default=unique_vals.tolist()
+                for filter_col in filter_cols:
+                    # Filtro según tipo de dato (límites calculados en SQLite)
+                    if kinds.get(filter_col) == 'encrypted':
+                        if filter_col not in blind_columns(db_path, table):
+                            st.caption(f"🔒 {filter_col}: columna cifrada, no se puede filtrar sin descifrar la tabla")
+                            continue
+                        exact = st.text_input(
+                            f"Valor exacto ({filter_col}):", key=f"filtro_{filter_col}",
+                            help="Igualdad sobre el índice ciego (HMAC); varios valores separados por «;»"
+                        )
+                        values = [v.strip() for v in exact.split(";") if v.strip()]
+                        blind = blind_filter(db_path, table, filter_col, values) if values else None
+                        if blind:
+                            filters.append(blind)
+                        elif values:
+                            st.caption(f"🔒 {filter_col}: hace falta la clave para buscar")
+                    
+                    elif kinds.get(filter_col) == 'numeric':
+                        lo, hi = column_bounds(db_path, table, filter_col)
+                        if pd.isna(lo):
+                            st.warning(f"⚠️ '{filter_col}' no tiene valores")
+                            continue
+                        min_val, max_val = float(lo), float(hi)
+                        if min_val == max_val:
+                            st.caption(f"{filter_col}: valor único {min_val:g}")
+                            continue
+                        range_vals = st.slider(
+                            f"Rango de valores ({filter_col}):",
+                            min_val, max_val, (min_val, max_val),
+                            key=f"filtro_{filter_col}"
                         )
-                        if selected_vals:
-                            filtered_df = df[df[filter_col].isin(selected_vals)]
+                        filters.append(('range', filter_col, range_vals[0], range_vals[1]))
+                    
+                    elif kinds.get(filter_col) == 'datetime':
+                        lo, hi = column_bounds(db_path, table, filter_col)
+                        date_range = st.date_input(
+                            f"Rango de fechas ({filter_col}):",
+                            value=(pd.Timestamp(lo).date(), pd.Timestamp(hi).date()),
+                            key=f"filtro_{filter_col}"
+                        )
+                        if len(date_range) == 2:
+                            filters.append(('date', filter_col, date_range[0].isoformat(),
+                                            (date_range[1] + timedelta(days=1)).isoformat()))
+                    
                     else:
-                        search_term = st.text_input("Buscar texto:")
-                        if search_term:
-                            filtered_df = df[df[filter_col].astype(str).str.contains(search_term, case=False, na=False)]
+                        unique_vals = distinct_values(db_path, table, filter_col)
+                        if unique_vals is not None:
+                            selected_vals = st.multiselect(
+                                f"Selecciona valores ({filter_col}):",
+                                options=unique_vals,
+                                default=unique_vals,
+                                key=f"filtro_{filter_col}"
+                            )
+                            if selected_vals:
+                                filters.append(('in', filter_col, tuple(selected_vals)))
                         else:
-                            filtered_df = df
+                            search_term = st.text_input(
+                                f"Buscar texto ({filter_col}):", key=f"filtro_{filter_col}",
+                                help="Búsqueda por palabras (índice FTS5)" if filter_col in search_cols else None
+                            )
+                            query = fts_query(filter_col, search_term) if filter_col in search_cols else None
+                            if query:
+                                filters.append(('match', filter_col, query, fts_table(table)))
+                            elif search_term:
+                                filters.append(('contains', filter_col, search_term))
+        
+        filters = tuple(filters)
+        
+        if filter_cols:
+            filtered_rows = count_filtered(db_path, table, filters, observe=True)
+            join_sql, order_sql, join_params, rest = fts_ranking(table, filters)
+            where_sql, where_params = build_where(rest)
+            cols_sql = ", ".join(f'"{table}".{quote_ident(c)}' for c in table_cols)
+            session_query("preview_job", db_path,
+                          f'SELECT {cols_sql} FROM "{table}"{join_sql}{where_sql}{order_sql} LIMIT {SAMPLE_ROWS}',
+                          join_params + where_params, table=table)
             
-            st.success(f"✅ Resultados: {len(filtered_df):,} de {len(df):,} filas")
-            st.dataframe(filtered_df.head(100), use_container_width=True, height=350)
+            st.success(f"✅ Resultados: {filtered_rows:,} de {total_rows:,} filas")
+            show_query_job("preview_job",
+                           lambda part: st.dataframe(decrypt_page(db_path, table, part.head(100)),
+                                                     use_container_width=True, height=350))
             
             # Análisis por grupos
             st.markdown("---")
@@ -414,12 +2998,12 @@ if st.session_state.current_table:
             
             col1, col2, col3 = st.columns(3)
             with col1:
-                categorical_cols = [c for c in filtered_df.columns if filtered_df[c].dtype == 'object' or len(filtered_df[c].unique()) < 50]
+                categorical_cols = group_candidates(db_path, table)
                 group_col = st.selectbox("Agrupar por:", ["--No agrupar--"] + categorical_cols)
             
             if group_col != "--No agrupar--":
                 with col2:
-                    numeric_cols_filter = [c for c in filtered_df.columns if pd.api.types.is_numeric_dtype(filtered_df[c])]
+                    numeric_cols_filter = [c for c in table_cols if kinds.get(c) == 'numeric']
                     if numeric_cols_filter:
                         agg_col = st.selectbox("Columna a agregar:", numeric_cols_filter)
                     else:
@@ -427,12 +3011,10 @@ if st.session_state.current_table:
                         agg_col = None
                 with col3:
                     agg_func = st.selectbox("Función:", ["sum", "mean", "count", "min", "max"])
+                group_engine = st.radio("Motor:", list(ENGINES), format_func=lambda n: ENGINES[n].label,
+                                        horizontal=True, key="engine_groups")
                 
-                if st.button("🔄 Calcular") and agg_col:
-                    grouped = filtered_df.groupby(group_col)[agg_col].agg(agg_func).reset_index()
-                    grouped.columns = [group_col, f"{agg_func}_{agg_col}"]
-                    grouped = grouped.sort_values(f"{agg_func}_{agg_col}", ascending=False)
-                    
+                def show_groups(grouped: pd.DataFrame):
                     st.success(f"✅ Grupos calculados: {len(grouped)}")
                     st.dataframe(grouped, use_container_width=True, height=300)
                     
@@ -444,13 +3026,80 @@ if st.session_state.current_table:
                         tooltip=[group_col, f"{agg_func}_{agg_col}"]
                     ).properties(height=400)
                     st.altair_chart(chart, use_container_width=True)
+                
+                calculate = st.button("🔄 Calcular")
+                if agg_col:
+                    group_sql, group_params, engine = group_aggregate_query(
+                        db_path, table, filters, group_col, agg_col, agg_func, group_engine)
+                    if calculate:
+                        get_index_advisor().observe(db_path, table, 'grupo', (group_col, agg_col),
+                                                    group_sql, group_params)
+                    if engine.name == 'sqlite':
+                        # En segundo plano: se puede cancelar y el resultado sigue visible entre ejecuciones
+                        job = st.session_state.get("group_job")
+                        if calculate:
+                            session_query("group_job", db_path, group_sql, group_params, table=table, typed=False)
+                        elif job is not None and job.key != query_key(db_path, group_sql, group_params,
+                                                                      table, False, 'sqlite'):
+                            job.cancel()
+                            del st.session_state["group_job"]
+                        show_query_job("group_job", show_groups)
+                    elif calculate:
+                        show_groups(run_query(db_path, group_sql, group_params, table=table, typed=False,
+                                              engine=engine.name))
+        
+        # Asesor de índices
+        with st.expander("🧭 Índices sugeridos"):
+            used = advisor_bytes(db_path)
+            budget = INDEX_BUDGET_MB * 1024 * 1024
+            st.caption(f"Disco de los índices del asesor: {used / 1e6:,.1f} / {INDEX_BUDGET_MB} MB")
+            auto_index = st.checkbox("Crear automáticamente los sugeridos (dentro del presupuesto)", key="auto_index")
+            proposals = index_proposals(db_path, table)
+            if proposals.empty:
+                st.caption(f"Sin sugerencias: se proponen columnas usadas en al menos {INDEX_MIN_USES} "
+                           f"filtros o agrupaciones distintas")
+            else:
+                for prop in proposals.head(5).itertuples(index=False):
+                    fits = used + prop.bytes_est <= budget
+                    col1, col2 = st.columns([4, 1])
+                    col1.markdown(f"**{', '.join(prop.columnas)}** • {prop.tipo} • {prop.uso} • "
+                                  f"{prop.veces} consultas • ~{prop.bytes_est / 1e6:,.1f} MB"
+                                  + ("" if fits else " • ⚠️ fuera de presupuesto"))
+                    if col2.button("Crear", key=f"crear_{index_name(table, prop.columnas)}", disabled=not fits):
+                        with st.spinner("Creando índice..."):
+                            create_index(db_path, table, prop.columnas, prop.consulta, prop.parametros)
+                        st.rerun()
+                if auto_index:
+                    fitting = [p for p in proposals.itertuples(index=False) if used + p.bytes_est <= budget]
+                    if fitting:
+                        try:
+                            entry = create_index(db_path, table, fitting[0].columnas, fitting[0].consulta,
+                                                 fitting[0].parametros, timeout=WRITER_TIMEOUT_S)
+                            st.toast(f"🧭 Índice creado en {', '.join(fitting[0].columnas)}: "
+                                     f"{entry['antes_ms']:.1f} → {entry['despues_ms']:.1f} ms")
+                            st.rerun()
+                        except TimeoutError:
+                            pass  # el escritor está ocupado: se reintenta en la próxima ejecución
+            
+            report = index_report(db_path, table)
+            if not report.empty:
+                report['mejora'] = (report['antes_ms'] / report['despues_ms']).round(1).astype(str) + "×"
+                st.dataframe(report, use_container_width=True, hide_index=True)
     
     # TAB 3: Visualizaciones
     with tab3:
         st.markdown("### 📈 Visualizaciones Interactivas")
         
-        numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
-        categorical_cols = df.select_dtypes(include=['object']).columns.tolist()
+        numeric_cols = [c for c in table_cols if kinds.get(c) == 'numeric']
+        categorical_cols = [c for c in table_cols if kinds.get(c) == 'text']
+        
+        use_viz_filters = st.checkbox("Aplicar los filtros de la pestaña 🔍 Filtros", value=bool(filters),
+                                      disabled=not filters, key="viz_filters")
+        viz_filters = filters if use_viz_filters else ()
+        viz_engine = st.radio("Motor de consultas:", list(ENGINES), format_func=lambda n: ENGINES[n].label,
+                              horizontal=True, key="engine_viz")
+        if query_engine(viz_engine, db_path, table, viz_filters).name != viz_engine:
+            st.caption("ℹ️ La copia columnar aún no está lista (o hay búsqueda de texto): se usa SQLite")
         
         viz_type = st.selectbox(
             "Tipo de visualización:",
@@ -464,7 +3113,8 @@ if st.session_state.current_table:
             with col2:
                 y_col = st.selectbox("Valor (Y):", numeric_cols)
             
-            chart_data = df.groupby(x_col)[y_col].mean().reset_index().head(20)
+            chart_data = group_aggregate(db_path, table, viz_filters, x_col, y_col, 'mean', viz_engine).head(20)
+            chart_data.columns = [x_col, y_col]
             chart = alt.Chart(chart_data).mark_bar(color='#667eea').encode(
                 x=alt.X(x_col, sort='-y'),
                 y=y_col,
@@ -476,12 +3126,8 @@ if st.session_state.current_table:
             col = st.selectbox("Columna:", numeric_cols)
             bins = st.slider("Número de bins:", 10, 100, 30)
             
-            chart = alt.Chart(df).mark_bar(color='#764ba2').encode(
-                x=alt.X(col, bin=alt.Bin(maxbins=bins)),
-                y='count()',
-                tooltip=['count()']
-            ).properties(height=500)
-            st.altair_chart(chart, use_container_width=True)
+            hist_df = histogram(db_path, table, col, bins, viz_filters, viz_engine)
+            st.altair_chart(histogram_chart(hist_df, col), use_container_width=True)
         
         elif viz_type == "Dispersión" and len(numeric_cols) >= 2:
             col1, col2, col3 = st.columns(3)
@@ -492,55 +3138,160 @@ if st.session_state.current_table:
             with col3:
                 color_col = st.selectbox("Color:", ["--Ninguno--"] + categorical_cols)
             
-            chart = alt.Chart(df.sample(min(1000, len(df)))).mark_circle(size=60).encode(
-                x=x_col,
-                y=y_col,
-                tooltip=[x_col, y_col] + ([color_col] if color_col != "--Ninguno--" else [])
-            )
+            # Zoom: rango de cada eje (por defecto, la tabla completa)
+            zoom = []
+            col1, col2, col3 = st.columns([2, 2, 1])
+            for column, axis_col in ((col1, x_col), (col2, y_col)):
+                lo, hi = table_stats[axis_col]['min'], table_stats[axis_col]['max']
+                lo, hi = (float(lo), float(hi)) if lo is not None else (0.0, 0.0)
+                with column:
+                    if hi > lo:
+                        lo, hi = st.slider(f"Rango de {axis_col}:", lo, hi, (lo, hi), key=f"zoom_{axis_col}")
+                zoom += [lo, hi]
+            zoom = tuple(zoom)
+            with col3:
+                scatter_mode = st.radio("Representación:", ["Automática", "Densidad", "Muestra"])
             
-            if color_col != "--Ninguno--":
-                chart = chart.encode(color=color_col)
+            zoom_filters = _scatter_filters(x_col, y_col, zoom, viz_filters)
+            n_points = count_filtered(db_path, table, zoom_filters)
+            density = scatter_density(db_path, table, x_col, y_col, viz_filters, zoom)
+            if scatter_mode == "Automática":
+                use_density = n_points > SCATTER_DENSITY_ROWS
+            else:
+                use_density = scatter_mode == "Densidad"
+            
+            if use_density:
+                st.caption(f"🟪 Mapa de densidad: {n_points:,} puntos agregados en {len(density):,} celdas")
+                chart = alt.Chart(density).mark_rect().encode(
+                    x=alt.X('x0:Q', title=x_col), x2='x1:Q',
+                    y=alt.Y('y0:Q', title=y_col), y2='y1:Q',
+                    color=alt.Color('filas:Q', scale=alt.Scale(type='log', scheme='purples')),
+                    tooltip=['filas:Q']
+                )
+            else:
+                color = color_col if color_col != "--Ninguno--" else None
+                sample = scatter_sample(db_path, table, x_col, y_col, color, viz_filters, zoom, len(density))
+                st.caption(f"⚪ {len(sample):,} de {n_points:,} puntos (muestra estratificada, semilla fija) "
+                           f"• {int(sample['atipico'].sum()):,} atípicos siempre incluidos")
+                chart = alt.Chart(sample).mark_circle(size=60).encode(
+                    x=x_col,
+                    y=y_col,
+                    tooltip=[x_col, y_col] + ([color_col] if color else [])
+                )
+                if color:
+                    chart = chart.encode(color=color_col)
+                outliers = alt.Chart(sample[sample['atipico']]).mark_point(size=120, color='#d62728').encode(
+                    x=x_col, y=y_col
+                )
+                chart = chart + outliers
             
             chart = chart.properties(height=500).interactive()
             st.altair_chart(chart, use_container_width=True)
     
+        elif viz_type == "Línea de Tiempo":
+            date_cols = [c for c in table_cols if kinds.get(c) == 'datetime']
+            if not date_cols:
+                st.warning("⚠️ No hay columnas de fecha en formato ISO-8601")
+            else:
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    date_col = st.selectbox("Fecha:", date_cols)
+                with col2:
+                    bucket = st.selectbox("Periodo:", list(TIME_BUCKETS), index=2)
+                with col3:
+                    value_col = st.selectbox("Valor:", ["Número de filas"] + numeric_cols)
+                with col4:
+                    ts_func = st.selectbox("Función:", ["mean", "sum", "min", "max"],
+                                           disabled=value_col == "Número de filas", key="ts_func")
+                
+                value_col = None if value_col == "Número de filas" else value_col
+                series = time_series(db_path, table, date_col, bucket, value_col, ts_func, viz_filters)
+                y_title = "filas" if value_col is None else f"{ts_func}_{value_col}"
+                if len(series) > TIMESERIES_MAX_POINTS:
+                    keep = lttb(series['periodo'].astype('int64').to_numpy().astype(float),
+                                series['valor'].fillna(0).to_numpy(dtype=float), TIMESERIES_MAX_POINTS)
+                    st.caption(f"📉 {len(series):,} periodos reducidos a {len(keep):,} puntos (LTTB)")
+                    series = series.iloc[keep]
+                chart = alt.Chart(series).mark_line(color='#667eea', point=len(series) <= 100).encode(
+                    x=alt.X('periodo:T', title=date_col),
+                    y=alt.Y('valor:Q', title=y_title),
+                    tooltip=['periodo:T', 'valor:Q']
+                ).properties(height=500).interactive()
+                st.altair_chart(chart, use_container_width=True)
+        
+        elif viz_type == "Caja":
+            if not categorical_cols or not numeric_cols:
+                st.warning("⚠️ Hace falta una columna de texto y una numérica")
+            else:
+                col1, col2 = st.columns(2)
+                with col1:
+                    cat_col = st.selectbox("Categoría:", categorical_cols, key="box_cat")
+                with col2:
+                    box_col = st.selectbox("Valor:", numeric_cols, key="box_val")
+                
+                boxes = quantile_sketch(db_path, table, cat_col, box_col, viz_filters)
+                if boxes.empty:
+                    st.warning("⚠️ No hay datos para esta combinación")
+                else:
+                    st.caption(f"📦 Cuartiles aproximados ({BOX_SKETCH_BINS} barras por categoría) "
+                               f"de las {len(boxes)} categorías más frecuentes")
+                    base = alt.Chart(boxes).encode(x=alt.X('categoria:N', title=cat_col, sort='-y'))
+                    tooltip = ['categoria', 'n', 'minimo', 'q1', 'mediana', 'q3', 'maximo']
+                    chart = (
+                        base.mark_rule().encode(y=alt.Y('bigote_inf:Q', title=box_col), y2='bigote_sup:Q')
+                        + base.mark_bar(size=28, color='#764ba2').encode(y='q1:Q', y2='q3:Q', tooltip=tooltip)
+                        + base.mark_tick(color='white', size=28, thickness=2).encode(y='mediana:Q')
+                    ).properties(height=500)
+                    st.altair_chart(chart, use_container_width=True)
+        
+        with st.expander("⏱️ Comparar motores"):
+            if categorical_cols and numeric_cols:
+                if st.button("Ejecutar comparación", key="bench_engines"):
+                    bench = benchmark_engines(db_path, table, categorical_cols[0], numeric_cols[0],
+                                              numeric_cols[0], viz_filters)
+                    st.dataframe(bench, use_container_width=True, hide_index=True)
+                    st.caption(f"GROUP BY {categorical_cols[0]} / media de {numeric_cols[0]} e histograma "
+                               f"de {numeric_cols[0]}; mejor de 3 ejecuciones, sin caché")
+            else:
+                st.caption("Hace falta una columna de texto y una numérica")
+    
     # TAB 4: Exportar
     with tab4:
         st.markdown("### 💾 Exportar Resultados")
         
-        st.info("📥 Descarga tus datos en diferentes formatos")
+        st.info("📥 Descarga la tabla completa en diferentes formatos (se genera solo al pedirla)")
         
-        col1, col2, col3 = st.columns(3)
+        use_filters = st.checkbox("Aplicar los filtros de la pestaña 🔍 Filtros", value=bool(filters),
+                                  disabled=not filters)
+        export_filters = filters if use_filters else ()
         
-        with col1:
-            csv_data = download_data(df, 'csv')
-            st.download_button(
-                label="📄 Descargar CSV",
-                data=csv_data,
-                file_name=f"{table}_export.csv",
-                mime="text/csv",
-                use_container_width=True
-            )
-        
-        with col2:
-            excel_data = download_data(df, 'excel')
-            st.download_button(
-                label="📊 Descargar Excel",
-                data=excel_data,
-                file_name=f"{table}_export.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                use_container_width=True
-            )
+        col1, col2, col3 = st.columns(3)
+        export_buttons = [
+            (col1, 'csv', "📄", "CSV"),
+            (col2, 'excel', "📊", "Excel"),
+            (col3, 'parquet', "🗜️", "Parquet"),
+        ]
         
-        with col3:
-            parquet_data = download_data(df, 'parquet')
-            st.download_button(
-                label="🗜️ Descargar Parquet",
-                data=parquet_data,
-                file_name=f"{table}_export.parquet",
-                mime="application/octet-stream",
-                use_container_width=True
-            )
+        for column, fmt, icon, label in export_buttons:
+            with column:
+                path = export_path(db_path, table, export_filters, fmt)
+                if not os.path.exists(path):
+                    if st.button(f"⚙️ Generar {label}", key=f"export_{fmt}", use_container_width=True):
+                        with st.spinner(f"Generando {label}..."):
+                            try:
+                                path = export_table(db_path, table, export_filters, fmt)
+                            except Exception as e:
+                                st.error(f"❌ Error: {str(e)}")
+                if os.path.exists(path):
+                    with open(path, 'rb') as f:
+                        st.download_button(
+                            label=f"{icon} Descargar {label}",
+                            data=f,
+                            file_name=f"{table}_export.{EXPORT_FORMATS[fmt][0]}",
+                            mime=EXPORT_FORMATS[fmt][1],
+                            use_container_width=True
+                        )
+                    st.caption(f"{os.path.getsize(path) / 1e6:,.1f} MB • listo en disco")
 
 else:
     # Pantalla de bienvenida
@@ -585,6 +3336,37 @@ else:
         - Exportación fácil
         """)
 
+# ======================
+# Sidebar: Perfil de consultas (al final, para incluir esta ejecución)
+# ======================
+with st.sidebar:
+    with st.expander("⏱️ Perfil de consultas"):
+        profiler = get_profiler()
+        records = profiler.records()
+        if not records:
+            st.caption("Sin llamadas registradas")
+        else:
+            profile_df = pd.DataFrame(records)
+            hits = (profile_df['cache'] == 'hit').sum()
+            lookups = profile_df['cache'].isin(['hit', 'miss']).sum()
+            st.caption(f"{len(profile_df):,} llamadas • {profile_df['segundos'].sum():.2f} s • "
+                       f"aciertos de caché: {hits / lookups if lookups else 0:.0%} • "
+                       f"escaneos completos: {int(profile_df['escaneo'].sum()):,}")
+            st.dataframe(profile_df.iloc[::-1].drop(columns=['plan']), use_container_width=True,
+                         height=250, hide_index=True)
+            slowest = profile_df.nlargest(1, 'segundos').iloc[0]
+            if slowest['plan']:
+                st.caption(f"Plan de la más lenta ({slowest['segundos'] * 1000:.0f} ms):")
+                st.code(slowest['plan'], language=None)
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button("📥 JSONL", data=profiler.to_jsonl(), file_name="perfil_consultas.jsonl",
+                                   mime="application/jsonl", key="profile_export")
+            with col2:
+                if st.button("🗑️ Limpiar", key="profile_clear"):
+                    profiler.clear()
+                    st.rerun()
+
 st.markdown("---")
 st.markdown("""
 <p style="text-align: center; color: #666; font-size: 0.9rem;">